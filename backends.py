@@ -0,0 +1,151 @@
+from collections import OrderedDict
+import numpy as np
+from scipy import sparse
+import bresenham
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+class NumpyBackend:
+    # Reference kernels: vectorized NumPy rasterization and SciPy sparse products.
+    name = "numpy"
+
+    def bresenham_batch(self, x0, y0, x1, y1, start=None, stop=None):
+        return bresenham.bresenham_batch(x0, y0, x1, y1, start, stop)
+
+    def gather_sum(self, matrix, x):
+        # matrix @ x for a CSR matrix: every output element sums the inputs its row touches.
+        return matrix @ x
+
+    def scatter_add(self, matrix, x):
+        # matrix.T @ x for a CSR matrix: every input element is added to the outputs its row touches.
+        return transpose(matrix) @ x
+
+
+class NumbaBackend(NumpyBackend):
+    # The same kernels as plain loops compiled by Numba. Compiled code is cached next to this file, so only the first
+    # run after an install or an edit pays the compilation, and it releases the GIL for parallel.run_in_chunks. Sums
+    # run in the same order as in SciPy, so both backends give identical results.
+    name = "numba"
+
+    def __init__(self):
+        jit = numba.njit(cache=True, nogil=True)
+        self.bresenham_fill = jit(bresenham_fill)
+        self.csr_gather_sum = jit(csr_gather_sum)
+        self.csr_scatter_add = jit(csr_scatter_add)
+
+    def bresenham_batch(self, x0, y0, x1, y1, start=None, stop=None):
+        x0, y0, x1, y1 = (np.asarray(v, dtype=np.int64).ravel() for v in (x0, y0, x1, y1))
+        if start is None:
+            start = np.zeros(len(x0), dtype=np.int64)
+            stop = np.maximum(np.abs(x1 - x0), np.abs(y1 - y0)) + 1
+        start, stop = np.asarray(start, dtype=np.int64), np.asarray(stop, dtype=np.int64)
+        offsets = np.zeros(len(x0) + 1, dtype=np.int64)
+        np.cumsum(np.maximum(stop - start, 0), out=offsets[1:])
+        return self.bresenham_fill(x0, y0, x1, y1, start, offsets), offsets
+
+    def gather_sum(self, matrix, x):
+        out = np.zeros((matrix.shape[0],) + x.shape[1:], dtype=np.result_type(matrix.dtype, x.dtype))
+        self.csr_gather_sum(matrix.indptr, matrix.indices, matrix.data, as_columns(x), as_columns(out))
+        return out
+
+    def scatter_add(self, matrix, x):
+        out = np.zeros((matrix.shape[1],) + x.shape[1:], dtype=np.result_type(matrix.dtype, x.dtype))
+        self.csr_scatter_add(matrix.indptr, matrix.indices, matrix.data, as_columns(x), as_columns(out))
+        return out
+
+
+def transpose(matrix):
+    # matrix.T as a CSC view of the same arrays. matrix.T goes through the constructor, which copies arrays that are
+    # views of much larger ones, such as the blocks of projection.row_block.
+    transposed = sparse.csc_matrix((matrix.shape[1], matrix.shape[0]), dtype=matrix.dtype)
+    transposed.data, transposed.indices, transposed.indptr = matrix.data, matrix.indices, matrix.indptr
+    return transposed
+
+
+def as_columns(x):
+    # The kernels take (n, k) arrays, so one vector and a stack of k vectors share one compiled signature.
+    return np.ascontiguousarray(x).reshape(len(x), -1)
+
+
+def bresenham_fill(x0, y0, x1, y1, start, offsets):
+    # Same closed form as bresenham.bresenham_batch, one ray at a time.
+    paths = np.empty((offsets[-1], 2), dtype=np.int64)
+    for r in range(len(x0)):
+        kx = -1 if x0[r] > x1[r] else 1
+        ky = -1 if y0[r] > y1[r] else 1
+        dx = abs(x1[r] - x0[r])
+        dy = abs(y1[r] - y0[r])
+        major = max(dx, dy)
+        minor = min(dx, dy)
+        for i in range(offsets[r + 1] - offsets[r]):
+            k = start[r] + i
+            minor_k = -((major - 2 * k * minor) // max(2 * major, 1))
+            if dx > dy:
+                paths[offsets[r] + i, 0] = x0[r] + kx * k
+                paths[offsets[r] + i, 1] = y0[r] + ky * minor_k
+            else:
+                paths[offsets[r] + i, 0] = x0[r] + kx * minor_k
+                paths[offsets[r] + i, 1] = y0[r] + ky * k
+    return paths
+
+
+def csr_gather_sum(indptr, indices, data, x, out):
+    for row in range(len(indptr) - 1):
+        for j in range(indptr[row], indptr[row + 1]):
+            for column in range(x.shape[1]):
+                out[row, column] += data[j] * x[indices[j], column]
+
+
+def csr_scatter_add(indptr, indices, data, x, out):
+    for row in range(len(indptr) - 1):
+        for j in range(indptr[row], indptr[row + 1]):
+            for column in range(x.shape[1]):
+                out[indices[j], column] += data[j] * x[row, column]
+
+
+_backends = OrderedDict()
+_instances = {}
+
+
+def register(name, factory, available=True):
+    _backends[name] = (factory, available)
+
+
+def get_names():
+    return [name for name, (_, available) in _backends.items() if available]
+
+
+def get_choices():
+    # Values accepted by get_backend, including backends that would fall back.
+    return ["auto"] + list(_backends)
+
+
+def get_backend(name="auto"):
+    # "auto" picks the fastest available backend, the last registered one. A backend whose dependency is missing
+    # falls back to the reference one, so settings and scripts that ask for it keep working everywhere.
+    if name == "auto":
+        name = get_names()[-1]
+    if name not in _backends:
+        raise ValueError("Unknown backend: %s" % name)
+    factory, available = _backends[name]
+    if not available:
+        name, factory = "numpy", NumpyBackend
+    if name not in _instances:
+        _instances[name] = factory()
+    return _instances[name]
+
+
+def use(name="auto"):
+    # Selects the backend for all later kernel calls in this process; returns it, so callers can see what they got.
+    global active
+    active = get_backend(name)
+    return active
+
+
+register("numpy", NumpyBackend)
+register("numba", NumbaBackend, numba is not None)
+active = get_backend()
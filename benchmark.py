@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import backends
+import bresenham
+import filter
+import ingest
+import projection
+import tomograph
+
+default_images = ["examples/sl100.jpg", "examples/SL_200x200.jpg", "examples/Shepp_logan.jpg",
+                  "examples/CT_ScoutView-large.jpg"]
+
+
+def measure(function, repeat):
+    # Best wall time over `repeat` runs, plus the tracemalloc peak of one extra run.
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, min(times), peak_memory
+
+
+def benchmark_case(image_path, image, theta, detectors, span, filter_type, repeat, dtype="float64"):
+    image = image.astype(dtype)
+    params = tomograph.TomographParameters(image, theta, detectors, span, filter_type, dtype=dtype)
+    size = image.shape[0]
+    angles = params.emitter_angles
+    rays = len(angles) * detectors
+    sources, ends = projection.get_ray_endpoints(size, angles, detectors, params.span, "radon")
+    first_sources = [projection.Point(x, y) for x, y in zip(sources[0][:detectors], sources[1][:detectors])]
+    first_ends = [projection.Point(x, y) for x, y in zip(ends[0][:detectors], ends[1][:detectors])]
+    results = []
+
+    def record(stage, seconds, peak_memory, stage_rays=None, pixels=None, mse=None):
+        results.append({"image": os.path.basename(image_path), "size": size, "theta": theta, "detectors": detectors,
+                        "span": span, "filter": filter_type, "dtype": dtype, "stage": stage, "time": seconds,
+                        "rays_per_s": stage_rays / seconds if stage_rays else None,
+                        "pixels_per_s": pixels / seconds if pixels else None,
+                        "peak_memory": peak_memory, "mse": mse})
+
+    _, seconds, peak = measure(lambda: [bresenham.bresenham_indexes(a, b) for a, b in zip(first_sources, first_ends)],
+                               repeat)
+    record("bresenham_indexes", seconds, peak, stage_rays=detectors)
+    (paths, _), seconds, peak = measure(
+        lambda: backends.active.bresenham_batch(sources[0], sources[1], ends[0], ends[1]), repeat)
+    record("bresenham_batch", seconds, peak, stage_rays=rays, pixels=len(paths))
+
+    def build_matrices():
+        projection._matrices.clear()
+        return (params.get_system_matrix(size, "radon", whole=True),
+                params.get_system_matrix(size, "inverse_radon", whole=True))
+
+    (forward_matrix, backward_matrix), seconds, peak = measure(build_matrices, 1)
+    record("system_matrix", seconds, peak, stage_rays=2 * rays,
+           pixels=forward_matrix.matrix.nnz + backward_matrix.matrix.nnz)
+    sinogram, seconds, peak = measure(lambda: tomograph.radon(image, angles, detectors, params.span,
+                                                              system_matrix=forward_matrix), repeat)
+    record("radon", seconds, peak, stage_rays=rays, pixels=forward_matrix.matrix.nnz)
+    sinogram_filtered, seconds, peak = measure(lambda: filter.filter_sinogram(sinogram, filter_type), repeat)
+    record("filter_sinogram", seconds, peak, pixels=sinogram.size)
+    image_reconstructed, seconds, peak = measure(
+        lambda: tomograph.inverse_radon(sinogram_filtered, size, angles, detectors, params.span,
+                                        system_matrix=backward_matrix), repeat)
+    record("inverse_radon", seconds, peak, stage_rays=rays, pixels=backward_matrix.matrix.nnz)
+
+    def end_to_end():
+        scanner = tomograph.Tomograph(params, None, False)
+        scanner.image_reconstruction(lambda: None)
+        return scanner
+
+    scanner, seconds, peak = measure(end_to_end, repeat)
+    record("image_reconstruction", seconds, peak, stage_rays=rays, pixels=size * size, mse=float(scanner.mse_error))
+    return results
+
+
+def run_benchmarks(images, thetas, detectors_list, spans, filter_type, repeat, dtypes=("float64",)):
+    results = []
+    for image_path in images:
+        image = ingest.load_image(image_path)
+        for theta in thetas:
+            for detectors in detectors_list:
+                for span in spans:
+                    for dtype in dtypes:
+                        results.extend(benchmark_case(image_path, image, theta, detectors, span, filter_type, repeat,
+                                                      dtype))
+    projection._matrices.clear()
+    return {"environment": {"python": platform.python_version(), "numpy": np.__version__,
+                            "machine": platform.machine(), "processor": platform.processor(),
+                            "cpu_count": os.cpu_count(), "backend": backends.active.name},
+            "results": results}
+
+
+def result_key(result):
+    # Reports written before the dtype setting only contain float64 runs.
+    return (result["image"], result["theta"], result["detectors"], result["span"], result["filter"],
+            result.get("dtype", "float64"), result["stage"])
+
+
+def compare(report, baseline, threshold):
+    # Returns the results that are more than `threshold` (relative) slower than the baseline.
+    baseline_times = {result_key(result): result["time"] for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        base_time = baseline_times.get(result_key(result))
+        if base_time is None:
+            continue
+        ratio = result["time"] / base_time if base_time > 0 else 1.0
+        print("%-22s %-20s theta=%-5s det=%-5s span=%-5s %-7s %9.4fs  x%.2f" %
+              (result["image"], result["stage"], result["theta"], result["detectors"], result["span"],
+               result.get("dtype", "float64"), result["time"], ratio))
+        if ratio > 1 + threshold:
+            regressions.append(result)
+    return regressions
+
+
+def compare_dtypes(report, reference="float64"):
+    # Time, peak memory and MSE of every non-reference precision relative to the same case in `reference`.
+    references = {result_key(dict(result, dtype=reference)): result for result in report["results"]
+                  if result["dtype"] == reference}
+    for result in report["results"]:
+        base = references.get(result_key(dict(result, dtype=reference)))
+        if result["dtype"] == reference or base is None:
+            continue
+        time_ratio = result["time"] / base["time"] if base["time"] > 0 else 1.0
+        memory_ratio = result["peak_memory"] / base["peak_memory"] if base["peak_memory"] > 0 else 1.0
+        mse_difference = "  mse %+.2e" % (result["mse"] - base["mse"]) if result["mse"] is not None else ""
+        print("%-22s %-20s %s/%s  time x%.2f  memory x%.2f%s" %
+              (result["image"], result["stage"], result["dtype"], reference, time_ratio, memory_ratio,
+               mse_difference))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Benchmark ray tracing, radon, filtering and backprojection.")
+    parser.add_argument("images", nargs="*", default=default_images)
+    parser.add_argument("--theta", type=float, nargs="+", default=[2.0, 4.0])
+    parser.add_argument("--detectors", type=int, nargs="+", default=[100])
+    parser.add_argument("--span", type=float, nargs="+", default=[180.0])
+    parser.add_argument("--filter", default="ramp", dest="filter_type")
+    parser.add_argument("--dtype", nargs="+", default=["float64"], dest="dtypes", choices=["float64", "float32"],
+                        help="precisions to run; with both, float32 is also reported relative to float64")
+    parser.add_argument("--backend", default="auto", choices=backends.get_choices(),
+                        help="kernel backend; numba falls back to numpy when it is not installed")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the report to this JSON file")
+    parser.add_argument("--baseline", help="compare against this JSON report")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    backends.use(args.backend)
+    report = run_benchmarks(args.images, args.theta, args.detectors, args.span, args.filter_type, args.repeat,
+                            args.dtypes)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if len(args.dtypes) > 1:
+        compare_dtypes(report)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print("%d regression(s) over %d%%" % (len(regressions), args.threshold * 100))
+            sys.exit(1)
+    elif not args.output:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
-from numpy import array
+from numpy import abs, arange, array, asarray, column_stack, cumsum, maximum, repeat, where, zeros
+
 
 def bresenham_indexes(A, B):
     path = []
@@ -29,3 +30,30 @@ def bresenham_indexes(A, B):
             y += ky
     path.append([x, y])
     return array(path)
+
+
+def bresenham_batch(x0, y0, x1, y1, start=None, stop=None):
+    # Rasterizes many rays at once. Pixels of ray r are indexes[offsets[r]:offsets[r + 1]], in the same
+    # order bresenham_indexes walks them. After k steps along the major axis the error term of the scalar
+    # loop has taken ceil((2 * k * minor - major) / (2 * major)) steps along the minor axis, so any range of steps
+    # start[r] <= k < stop[r] can be rasterized on its own.
+    x0, y0, x1, y1 = (asarray(v, dtype=int).ravel() for v in (x0, y0, x1, y1))
+    kx = where(x0 > x1, -1, 1)
+    ky = where(y0 > y1, -1, 1)
+    dx = abs(x1 - x0)
+    dy = abs(y1 - y0)
+    x_major = dx > dy
+    major = where(x_major, dx, dy)
+    minor = where(x_major, dy, dx)
+    start = zeros(len(major), dtype=int) if start is None else asarray(start, dtype=int)
+    stop = major + 1 if stop is None else asarray(stop, dtype=int)
+    lengths = maximum(stop - start, 0)
+    offsets = zeros(len(lengths) + 1, dtype=int)
+    cumsum(lengths, out=offsets[1:])
+    k = arange(offsets[-1]) - repeat(offsets[:-1] - start, lengths)
+    major_k = repeat(major, lengths)
+    minor_k = -((major_k - 2 * k * repeat(minor, lengths)) // maximum(2 * major_k, 1))
+    x_major_k = repeat(x_major, lengths)
+    x = repeat(x0, lengths) + repeat(kx, lengths) * where(x_major_k, k, minor_k)
+    y = repeat(y0, lengths) + repeat(ky, lengths) * where(x_major_k, minor_k, k)
+    return column_stack((x, y)), offsets
@@ -1,5 +1,6 @@
-from numpy import abs, arange, empty, real, fft, sin, cos
-from cmath import exp, pi
+from functools import lru_cache
+from numpy import abs, arange, cos, empty, pi, sin
+from scipy import fft
 
 
 def generate_ramp_array(n):
@@ -12,29 +13,17 @@ def generate_ramp_array(n):
     return results / n
 
 
-def DFT(F):
-    M, N = F.shape
-    range_N = range(N)
-    range_M = range(M)
-    exp_item = -1j * pi * 2
-    return [
-        [sum([sum([F[m, n] * exp(exp_item * ((k / M) * m + (l / N) * n)) for n in range_N]) for m in range_M]) for l in
-         range_N] for k in range_M]
+def get_padded_length(detector_quantity, padding=True):
+    # Zero-padding to at least twice the row length keeps the circular convolution from wrapping around.
+    if not padding:
+        return detector_quantity
+    return fft.next_fast_len(2 * detector_quantity, real=True)
 
 
-def IDFT(F):
-    M, N = F.shape
-    range_N = range(N)
-    range_M = range(M)
-    exp_item = 1j * pi * 2
-    return [
-        [sum([sum([F[m, n] * exp(exp_item * ((k / M) * m + (l / N) * n)) for n in range_N]) for m in range_M]) / M * N
-         for l in range_N] for k in range_M]
-
-
-def filter_sinogram(sinogram, type):
-    detector_quantity = sinogram.shape[1]
-    ramp_array = generate_ramp_array(detector_quantity)
+@lru_cache(maxsize=64)
+def get_fourier_filter(detector_quantity, type, padding=True, dtype=float):
+    n = get_padded_length(detector_quantity, padding)
+    ramp_array = arange(n // 2 + 1) / n  # non-negative half of generate_ramp_array(n), as used by rfft
     omega = 2 * pi * ramp_array
     fourier_filter = 2 * abs(ramp_array)
     if type == "Shepp-logan":
@@ -45,8 +34,16 @@ def filter_sinogram(sinogram, type):
         fourier_filter *= (0.54 + 0.46 * cos(omega / 2))
     elif type == "Hann":
         fourier_filter *= (1 + cos(omega / 2)) / 2
-    # sinogram_freq_domain_filtered = DFT(sinogram) * ramp_filter
-    # sinogram_filtered = real(IDFT(sinogram_freq_domain_filtered))
-    sinogram_freq_domain_filtered = fft.fft(sinogram) * fourier_filter  # numpy fft is better optimized and much quicker
-    sinogram_filtered = real(fft.ifft(sinogram_freq_domain_filtered))
-    return sinogram_filtered
+    fourier_filter = fourier_filter.astype(dtype, copy=False)
+    fourier_filter.setflags(write=False)
+    return fourier_filter
+
+
+def filter_sinogram(sinogram, type, padding=True, workers=1):
+    # Filters along the last axis, so a single row, a sinogram or a stack of sinograms can be passed in one call.
+    # float32 input is transformed in complex64 and comes back as float32.
+    detector_quantity = sinogram.shape[-1]
+    n = get_padded_length(detector_quantity, padding)
+    sinogram_freq_domain = fft.rfft(sinogram, n=n, axis=-1, workers=workers)
+    sinogram_freq_domain *= get_fourier_filter(detector_quantity, type, padding, sinogram_freq_domain.real.dtype)
+    return fft.irfft(sinogram_freq_domain, n=n, axis=-1, workers=workers)[..., :detector_quantity]
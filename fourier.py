@@ -0,0 +1,78 @@
+import numpy as np
+from scipy import fft
+import filter
+import parallel
+import projection
+from profiling import profiler
+
+methods = ["Fourier"]
+
+
+def rebin_to_parallel(sinogram, emitter_angles, detector_quantity, span, radius):
+    # Every fan ray is a chord of the scanner circle. Between the emitter at angle a and the detector at a + d its
+    # normal points at a + d / 2 and it passes radius * cos(d / 2) from the center, so each detector column is a
+    # parallel projection at a fixed offset, shifted in angle by d / 2. Columns are resampled onto a common angle grid
+    # over the full circle, then every row onto unit-spaced offsets; offsets no detector sees are left at zero.
+    emitter_angles = np.asarray(emitter_angles, dtype=float)
+    half_chords = (np.pi - span / 2.0 + np.arange(detector_quantity) * span / detector_quantity) / 2
+    angles = np.arange(len(emitter_angles)) * 2 * np.pi / len(emitter_angles)
+    rebinned = np.empty((len(angles), detector_quantity), dtype=sinogram.dtype)
+    for i, half_chord in enumerate(half_chords):
+        rebinned[:, i] = np.interp(angles - half_chord, emitter_angles, sinogram[:, i], period=2 * np.pi)
+    offsets = radius * np.cos(half_chords[::-1])  # increasing
+    grid = np.arange(-radius, radius + 1)
+    position = np.interp(grid, offsets, np.arange(detector_quantity))
+    low = np.minimum(position.astype(int), detector_quantity - 2)
+    weight = (position - low).astype(sinogram.dtype)
+    inside = (grid >= offsets[0]) & (grid <= offsets[-1])
+    rebinned = rebinned[:, ::-1]
+    return angles, (rebinned[:, low] * (1 - weight) + rebinned[:, low + 1] * weight) * inside
+
+
+def get_slice_spectra(projections, workers=1):
+    # 1D FFT of every projection with offset 0 moved to index 0, zero-padded like filter_sinogram to oversample the
+    # radial frequency axis. Returns the non-negative half and the padded length.
+    radius = projections.shape[-1] // 2
+    length = filter.get_padded_length(projections.shape[-1])
+    padded = np.zeros((len(projections), length), dtype=projections.dtype)
+    padded[:, :radius + 1] = projections[:, radius:]
+    padded[:, length - radius:] = projections[:, :radius]
+    return fft.rfft(padded, axis=-1, workers=workers), length
+
+
+def grid_spectra(spectra, length, grid_length):
+    # Bilinear interpolation of the polar samples (angle over the full circle, frequency k / length) at the
+    # non-negative-column half of a grid_length x grid_length Cartesian frequency grid. A projection at angle t sums
+    # along the normal (sin t, -cos t) in (row, column) coordinates.
+    angles_count, frequencies_count = spectra.shape
+    dtype = spectra.real.dtype
+    k_row = fft.fftfreq(grid_length)[:, None]
+    k_col = fft.rfftfreq(grid_length)[None, :]
+    angle = np.arctan2(k_row, -k_col) % (2 * np.pi) * angles_count / (2 * np.pi)
+    frequency = np.hypot(k_row, k_col) * length
+    a0 = angle.astype(int)
+    wa = (angle - a0).astype(dtype)
+    a0 %= angles_count
+    a1 = (a0 + 1) % angles_count
+    f0 = np.minimum(frequency.astype(int), frequencies_count - 2)
+    wf = (frequency - f0).astype(dtype)
+    values = (spectra[a0, f0] * (1 - wa) + spectra[a1, f0] * wa) * (1 - wf)
+    values += (spectra[a0, f0 + 1] * (1 - wa) + spectra[a1, f0 + 1] * wa) * wf
+    values[frequency > frequencies_count - 1] = 0
+    return values
+
+
+def reconstruct(sinogram, size, emitter_angles, detector_quantity, span, workers=1):
+    # Direct Fourier inversion of a radon-layout sinogram: rebin to parallel projections, take their 1D spectra
+    # (Fourier slice theorem), grid them onto a Cartesian frequency grid and apply one inverse 2D FFT.
+    workers = parallel.get_worker_count(workers)
+    center, base = projection.get_scanner_circle(size, "radon")
+    radius = center.y - base.y
+    with profiler.stage("rebinning"):
+        _, projections = rebin_to_parallel(sinogram, emitter_angles, detector_quantity, span, radius)
+    with profiler.stage("gridding"):
+        spectra, length = get_slice_spectra(projections, workers)
+        grid_length = filter.get_padded_length(size)
+        values = grid_spectra(spectra, length, grid_length)
+    image = fft.irfft2(values, s=(grid_length, grid_length), workers=workers)
+    return np.roll(image, (center.x, center.y), axis=(0, 1))[:size, :size]
@@ -0,0 +1,91 @@
+import numpy as np
+from profiling import profiler
+
+
+class TransformSnapshot:
+    def __init__(self, sinogram=None, image_reconstructed=None, square_error=None) -> None:
+        self.sinogram = sinogram
+        self.image_reconstructed = image_reconstructed
+        self.mse_error = square_error
+
+
+class SnapshotHistory:
+    # Keeps the per-angle state of a run in roughly linear memory: the sinogram and the (filtered) projections
+    # fed to backprojection are referenced, not copied, and only every keyframe_interval-th partial reconstruction
+    # is stored. Any other snapshot is rebuilt from the nearest earlier keyframe by backprojecting the missing
+    # angles again.
+    def __init__(self, angles_count, size, system_matrix, memory_budget=None, keyframe_interval=None, dtype=float):
+        self.angles_count = angles_count
+        self.size = size
+        self.system_matrix = system_matrix
+        self.keyframe_interval = keyframe_interval or get_keyframe_interval(angles_count, size, memory_budget, dtype)
+        self.sinogram = None
+        self.projections = None
+        self.keyframes = {}
+        self.mse_errors = np.zeros(angles_count)
+        self.last_index = None
+        self.last_image = None
+
+    def __len__(self):
+        return self.angles_count
+
+    def add_sinogram(self, sinogram):
+        self.sinogram = sinogram
+
+    def add_image(self, iteration, image_reconstructed, mse_error):
+        if iteration % self.keyframe_interval == 0:
+            self.keyframes[iteration] = np.array(image_reconstructed)
+            profiler.count("snapshots_stored")
+            profiler.count("bytes_copied", image_reconstructed.nbytes)
+        self.mse_errors[iteration] = mse_error
+
+    def get_sinogram(self, i):
+        sinogram = np.zeros_like(self.sinogram)
+        sinogram[:i + 1] = self.sinogram[:i + 1]
+        return sinogram
+
+    def get_image(self, i):
+        keyframe = i - i % self.keyframe_interval
+        if self.last_index is not None and keyframe <= self.last_index <= i:
+            start, image = self.last_index, np.array(self.last_image)
+        else:
+            start, image = keyframe, np.array(self.keyframes[keyframe])
+        for j in range(start + 1, i + 1):
+            self.system_matrix.backproject_angle(self.projections[j], j, image)
+        self.last_index, self.last_image = i, image
+        return image
+
+    def get_snapshot(self, i):
+        return TransformSnapshot(self.get_sinogram(i), self.get_image(i), self.mse_errors[i])
+
+
+def get_keyframe_interval(angles_count, size, memory_budget, dtype=float):
+    # None keeps every partial reconstruction; a budget below one image still keeps the first.
+    if memory_budget is None:
+        return 1
+    image_bytes = size * size * np.dtype(dtype).itemsize
+    keyframes_count = max(1, memory_budget // image_bytes)
+    return max(1, int(np.ceil(angles_count / keyframes_count)))
+
+
+class IterationHistory:
+    # One full reconstruction per iteration of an iterative method; there are only a handful, so they are all kept.
+    def __init__(self, iterations_count):
+        self.sinogram = None
+        self.images = []
+        self.mse_errors = np.zeros(iterations_count)
+
+    def __len__(self):
+        return max(1, len(self.images))
+
+    def add_sinogram(self, sinogram):
+        self.sinogram = sinogram
+
+    def add_image(self, iteration, image_reconstructed, mse_error):
+        self.images.append(np.array(image_reconstructed))
+        profiler.count("snapshots_stored")
+        profiler.count("bytes_copied", image_reconstructed.nbytes)
+        self.mse_errors[iteration] = mse_error
+
+    def get_snapshot(self, i):
+        return TransformSnapshot(self.sinogram, self.images[i], self.mse_errors[i])
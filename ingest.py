@@ -0,0 +1,92 @@
+import math
+import os
+from collections import OrderedDict
+import numpy as np
+from skimage.color import rgb2gray
+from skimage.io import imread
+from skimage.transform import rescale
+from skimage.util import img_as_float
+
+image_extensions = (".png", ".jpeg", ".jpg", ".bmp", ".tif", ".tiff")
+array_extensions = (".npy", ".raw")
+modes = ["pad", "inscribed"]
+
+_images = OrderedDict()
+max_cached_bytes = 512 * 2 ** 20
+
+
+def load_image(path, resolution=None, mode="pad", raw_shape=None, raw_dtype="<u2", dtype=float):
+    # Decoded, rescaled and squared image ready for the scanner, cached by file, modification time and options.
+    # Cached arrays are shared between callers, so they are returned read-only.
+    path = os.path.abspath(path)
+    key = (path, os.path.getmtime(path), resolution, mode, raw_shape, raw_dtype, np.dtype(dtype))
+    if key in _images:
+        _images.move_to_end(key)
+        return _images[key]
+    image = read_image(path, raw_shape, raw_dtype)
+    if resolution:
+        scale = resolution / get_square_size(image.shape, mode)
+        image = rescale(image, scale, anti_aliasing=scale < 1)
+    image = make_image_square(image, mode, dtype)
+    image.setflags(write=False)
+    if image.nbytes > max_cached_bytes:
+        return image
+    _images[key] = image
+    while sum(cached.nbytes for cached in _images.values()) > max_cached_bytes:
+        _images.popitem(last=False)
+    return image
+
+
+def read_image(path, raw_shape=None, raw_dtype="<u2"):
+    # Grayscale float image. .npy files are memory-mapped and .raw files read as headerless 16-bit pixels, so large
+    # inputs skip image decoding; a square raw_shape is assumed when none is given. Float arrays are returned as they
+    # are, so a memory-mapped one is only read while make_image_square copies it into the padded image.
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npy":
+        image = np.load(path, mmap_mode="r")
+    elif extension == ".raw":
+        image = np.fromfile(path, dtype=raw_dtype)
+        if raw_shape is None:
+            side = int(np.sqrt(image.size))
+            raw_shape = (side, image.size // side)
+        image = image.reshape(raw_shape)
+    else:
+        return imread(path, as_gray=True)
+    if image.ndim == 3:
+        image = rgb2gray(image)
+    if np.issubdtype(image.dtype, np.floating):
+        return image
+    return img_as_float(image)
+
+
+def get_square_size(shape, mode="pad"):
+    if mode == "pad":
+        return int(np.ceil(np.sqrt(2) * max(shape)))
+    if mode == "inscribed":
+        return max(shape)
+    raise ValueError("Unknown ingest mode: %s" % mode)
+
+
+def make_image_square(image_original, mode="pad", dtype=None):
+    # "pad" grows the image to its diagonal so the scanner circle sees all of it; "inscribed" only pads it to a square
+    # and blanks what lies outside the inscribed circle, which the scanner would never see anyway. The image is
+    # copied once, straight into the padded result, converted to `dtype` (by default its own) on the way.
+    size = get_square_size(image_original.shape, mode)
+    pad = [size - s for s in image_original.shape]
+    new_center = [(s + p) // 2 for s, p in zip(image_original.shape, pad)]
+    old_center = [s // 2 for s in image_original.shape]
+    pad_before = [nc - oc for oc, nc in zip(old_center, new_center)]
+    image = np.zeros((size, size), dtype=dtype or image_original.dtype)
+    image[tuple(slice(pb, pb + s) for pb, s in zip(pad_before, image_original.shape))] = image_original
+    if mode == "inscribed":
+        # Row by row, so no size x size mask is allocated next to the image.
+        center = size // 2
+        for row in range(size):
+            reach = center ** 2 - (row - center) ** 2
+            if reach < 0:
+                image[row] = 0
+                continue
+            half_width = math.isqrt(reach)
+            image[row, :max(center - half_width, 0)] = 0
+            image[row, center + half_width + 1:] = 0
+    return image
@@ -0,0 +1,105 @@
+import numpy as np
+import backends
+from metrics import QualityMetrics
+
+methods = ["ART", "SART", "OS-SART"]
+
+
+def get_subsets(angles_count, subsets_count):
+    subsets_count = max(1, min(int(subsets_count), angles_count))
+    return [np.arange(s, angles_count, subsets_count) for s in range(subsets_count)]
+
+
+def inverse_or_zero(values, dtype=float):
+    values = np.asarray(values, dtype=dtype).ravel()
+    result = np.zeros_like(values)
+    np.divide(1.0, values, out=result, where=values > 0)
+    return result
+
+
+def art(sinogram, system_matrix, iterations=10, relaxation=0.5, original=None, tolerance=None, callback=None,
+        non_negative=True):
+    matrix = system_matrix.matrix
+    indptr, indices, data = matrix.indptr, matrix.indices, matrix.data
+    measured = np.asarray(sinogram, dtype=system_matrix.dtype).ravel()
+    row_norms = inverse_or_zero(matrix.multiply(matrix).sum(axis=1), system_matrix.dtype)
+    x = np.zeros(matrix.shape[1], dtype=system_matrix.dtype)
+
+    def update():
+        for r in range(matrix.shape[0]):
+            if row_norms[r] == 0:
+                continue
+            pixels = indices[indptr[r]:indptr[r + 1]]
+            weights = data[indptr[r]:indptr[r + 1]]
+            x[pixels] += relaxation * (measured[r] - weights @ x[pixels]) * row_norms[r] * weights
+            if non_negative:
+                x[pixels] = np.maximum(x[pixels], 0)
+
+    return iterate(update, x, system_matrix.size, iterations, original, tolerance, callback)
+
+
+def os_sart(sinogram, system_matrix, iterations=10, subsets=10, relaxation=1.0, original=None, tolerance=None,
+            callback=None, non_negative=True):
+    # Ordered-subset SART: every update uses the projections of one interleaved subset of angles, so each pass over
+    # the data applies `subsets` corrections instead of one.
+    matrix = system_matrix.matrix
+    d = system_matrix.detector_quantity
+    measured = np.asarray(sinogram, dtype=system_matrix.dtype).ravel()
+    prepared = []
+    for angles in get_subsets(len(system_matrix.emitter_angles), subsets):
+        rows = (angles[:, None] * d + np.arange(d)).ravel()
+        block = matrix[rows]
+        prepared.append((block, measured[rows], inverse_or_zero(block.sum(axis=1), system_matrix.dtype),
+                         inverse_or_zero(block.sum(axis=0), system_matrix.dtype)))
+    x = np.zeros(matrix.shape[1], dtype=system_matrix.dtype)
+
+    def update():
+        for block, block_measured, ray_lengths, pixel_weights in prepared:
+            residual = (block_measured - backends.active.gather_sum(block, x)) * ray_lengths
+            x[:] += relaxation * pixel_weights * backends.active.scatter_add(block, residual)
+            if non_negative:
+                np.maximum(x, 0, out=x)
+
+    return iterate(update, x, system_matrix.size, iterations, original, tolerance, callback)
+
+
+def sart(sinogram, system_matrix, iterations=10, relaxation=1.0, original=None, tolerance=None, callback=None,
+         non_negative=True):
+    return os_sart(sinogram, system_matrix, iterations, len(system_matrix.emitter_angles), relaxation, original,
+                   tolerance, callback, non_negative)
+
+
+def iterate(update, x, size, iterations, original, tolerance, callback):
+    # Without a reference image convergence is measured between consecutive iterates.
+    image = x.reshape(size, size)
+    metrics = QualityMetrics(original) if original is not None else None
+    previous_mse = previous_image = None
+    for iteration in range(iterations):
+        if metrics is None:
+            previous_image = np.array(image)
+        update()
+        if metrics is not None:
+            mse = metrics.mse(image)
+        else:
+            mse = QualityMetrics(previous_image).mse(image)
+        if callback is not None:
+            callback(iteration, image, mse)
+        if tolerance is not None:
+            if original is None and mse < tolerance:
+                break
+            if original is not None and previous_mse is not None and previous_mse - mse < tolerance:
+                break
+        previous_mse = mse
+    return np.array(image)
+
+
+def reconstruct(sinogram, system_matrix, method, iterations=10, subsets=10, original=None, tolerance=None,
+                callback=None):
+    if method == "ART":
+        return art(sinogram, system_matrix, iterations, original=original, tolerance=tolerance, callback=callback)
+    if method == "SART":
+        return sart(sinogram, system_matrix, iterations, original=original, tolerance=tolerance, callback=callback)
+    if method == "OS-SART":
+        return os_sart(sinogram, system_matrix, iterations, subsets, original=original, tolerance=tolerance,
+                       callback=callback)
+    raise ValueError("Unknown reconstruction method: %s" % method)
@@ -0,0 +1,33 @@
+from numpy import abs, arange, ceil, concatenate, cumsum, floor, maximum, minimum, repeat, sqrt, where, zeros
+
+
+def joseph_weights(x0, y0, x1, y1, size):
+    # Joseph's method: step one pixel at a time along the major axis of each ray and split the step length between
+    # the two pixels straddling the ray on the minor axis, by linear interpolation. Endpoints are real-valued.
+    # Returns (ray, x, y, weight) arrays for every non-zero entry inside the size x size image.
+    dx = x1 - x0
+    dy = y1 - y0
+    x_major = abs(dx) >= abs(dy)
+    u0, u1 = where(x_major, x0, y0), where(x_major, x1, y1)
+    v0, v1 = where(x_major, y0, x0), where(x_major, y1, x1)
+    du = u1 - u0
+    slope = where(du != 0, (v1 - v0) / where(du != 0, du, 1), 0)
+    step_length = sqrt(1 + slope ** 2)
+    low = maximum(ceil(minimum(u0, u1)), 0).astype(int)
+    high = minimum(floor(maximum(u0, u1)), size - 1).astype(int)
+    counts = maximum(high - low + 1, 0)
+    offsets = zeros(len(counts) + 1, dtype=int)
+    cumsum(counts, out=offsets[1:])
+    rays = repeat(arange(len(counts)), counts)
+    u = repeat(low, counts) + arange(offsets[-1]) - repeat(offsets[:-1], counts)
+    v = v0[rays] + (u - u0[rays]) * slope[rays]
+    v_floor = floor(v).astype(int)
+    fraction = v - v_floor
+    rays = concatenate((rays, rays))
+    u = concatenate((u, u))
+    v = concatenate((v_floor, v_floor + 1))
+    weights = concatenate((1 - fraction, fraction)) * step_length[rays]
+    valid = (v >= 0) & (v < size) & (weights > 0)
+    rays, u, v, weights = rays[valid], u[valid], v[valid], weights[valid]
+    x_major = x_major[rays]
+    return rays, where(x_major, u, v), where(x_major, v, u), weights
@@ -0,0 +1,67 @@
+import time
+import numpy as np
+
+
+class QualityMetrics:
+    # Compares reconstructions against one original image. The shifted original is computed once, MSE allocates a
+    # single temporary, and PSNR/SSIM are only computed when asked for. should_evaluate() decimates per-angle
+    # evaluation to every `every`-th step and at most once per `interval` seconds. With a boolean `mask` only the
+    # pixels inside it are compared, and SSIM is computed over its bounding box.
+    def __init__(self, original, every=1, interval=None, mask=None):
+        self.mask = mask
+        self.bounds = self.original_box = None
+        if mask is not None:
+            rows = np.flatnonzero(mask.any(axis=1))
+            columns = np.flatnonzero(mask.any(axis=0))
+            self.bounds = (slice(rows[0], rows[-1] + 1), slice(columns[0], columns[-1] + 1))
+            self.original_box = original[self.bounds]
+            original = original[mask]
+        self.original = original - original.min()
+        self.original_max = self.original.max()
+        self.every = max(1, int(every or 1))
+        self.interval = interval
+        self.last_evaluation = None
+
+    def normalize(self, reconstructed):
+        if self.mask is not None:
+            reconstructed = reconstructed[self.mask]
+        rec_copy = reconstructed - reconstructed.min()
+        rec_copy_max = rec_copy.max()
+        if rec_copy_max > 0 and self.original_max > 0:
+            rec_copy /= (rec_copy_max / self.original_max)
+        return rec_copy
+
+    def mse(self, reconstructed):
+        dif = self.normalize(reconstructed)
+        dif -= self.original
+        dif **= 2
+        return dif.sum() / dif.size
+
+    def psnr(self, reconstructed):
+        mse = self.mse(reconstructed)
+        if mse == 0:
+            return np.inf
+        return 10 * np.log10(self.original_max ** 2 / mse)
+
+    def ssim(self, reconstructed):
+        if self.mask is not None:
+            return QualityMetrics(self.original_box).ssim(reconstructed[self.bounds])
+        from skimage.metrics import structural_similarity
+        return structural_similarity(self.original, self.normalize(reconstructed),
+                                     data_range=self.original_max or 1.0)
+
+    def evaluate(self, reconstructed, names=("mse",)):
+        return {name: getattr(self, name)(reconstructed) for name in names}
+
+    def should_evaluate(self, step, is_last=False):
+        if is_last:
+            return True
+        if step % self.every != 0:
+            return False
+        if self.interval is None:
+            return True
+        now = time.perf_counter()
+        if self.last_evaluation is not None and now - self.last_evaluation < self.interval:
+            return False
+        self.last_evaluation = now
+        return True
@@ -0,0 +1,70 @@
+import json
+import os
+import numpy as np
+import filter
+import projection
+
+buffer_names = ["sinogram", "sinogram_filtered", "image_reconstructed"]
+
+
+def open_buffer(path, shape=None, mode="w+", dtype=float):
+    if mode == "w+":
+        return np.lib.format.open_memmap(path, mode=mode, dtype=dtype, shape=shape)
+    return np.load(path, mmap_mode=mode)
+
+
+def get_angles_per_chunk(size, params, memory_budget):
+    # Both layouts' operators for one chunk are alive at the same time; the forward one covers the whole image.
+    angle_nbytes = projection.estimate_angle_nbytes(size, params.emitter_angles, params.detector_quantity,
+                                                    params.span, "radon", params.projector, params.dtype)
+    return max(1, int(memory_budget // (2 * angle_nbytes)))
+
+
+def reconstruct_out_of_core(image, params, directory, memory_budget=256 * 2 ** 20):
+    # Filtered backprojection with the sinogram, filtered sinogram and reconstruction kept in .npy memmaps inside
+    # `directory`. Operators are built for one chunk of angles at a time and never cached in memory, so peak memory
+    # is bounded by memory_budget plus the input image.
+    os.makedirs(directory, exist_ok=True)
+    image = np.asarray(image, dtype=params.dtype)
+    size = image.shape[0]
+    angles_count = len(params.emitter_angles)
+    shape = (angles_count, params.detector_quantity)
+    sinogram = open_buffer(os.path.join(directory, "sinogram.npy"), shape, dtype=params.dtype)
+    sinogram_filtered = open_buffer(os.path.join(directory, "sinogram_filtered.npy"), shape, dtype=params.dtype)
+    image_reconstructed = open_buffer(os.path.join(directory, "image_reconstructed.npy"), (size, size),
+                                      dtype=params.dtype)
+    image_reconstructed[:] = 0
+    chunk = get_angles_per_chunk(size, params, memory_budget)
+    for start in range(0, angles_count, chunk):
+        end = min(start + chunk, angles_count)
+        angles = params.emitter_angles[start:end]
+        forward_matrix = projection.get_system_matrix(size, angles, params.detector_quantity, params.span, "radon",
+                                                      cache_dir=params.cache_dir, keep_in_memory=False,
+                                                      projector=params.projector, dtype=params.dtype)
+        sinogram[start:end] = forward_matrix.project(image, params.workers)
+        del forward_matrix
+        if params.filter_type != "None":
+            sinogram_filtered[start:end] = filter.filter_sinogram(sinogram[start:end], params.filter_type)
+        else:
+            sinogram_filtered[start:end] = sinogram[start:end]
+        backward_matrix = projection.get_backprojector(size, angles, params.detector_quantity, params.span,
+                                                       params.backprojection, cache_dir=params.cache_dir,
+                                                       keep_in_memory=False, projector=params.projector,
+                                                       dtype=params.dtype, roi=params.roi)
+        image_reconstructed += backward_matrix.backproject(sinogram_filtered[start:end], params.workers)
+        del backward_matrix
+    for buffer in (sinogram, sinogram_filtered, image_reconstructed):
+        buffer.flush()
+    with open(os.path.join(directory, "parameters.json"), "w") as f:
+        json.dump({"theta": params.theta_deg, "detector_quantity": params.detector_quantity,
+                   "span": params.span_deg, "filter_type": params.filter_type, "size": size,
+                   "dtype": params.dtype.name}, f)
+    return sinogram, sinogram_filtered, image_reconstructed
+
+
+def open_results(directory, mode="r"):
+    # Reopens a finished out-of-core run without recomputing it.
+    with open(os.path.join(directory, "parameters.json")) as f:
+        parameters = json.load(f)
+    buffers = [open_buffer(os.path.join(directory, name + ".npy"), mode=mode) for name in buffer_names]
+    return parameters, buffers
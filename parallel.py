@@ -0,0 +1,43 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def get_worker_count(workers):
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return int(workers)
+
+
+def split_range(n, parts):
+    parts = max(1, min(parts, n))
+    return [(n * i // parts, n * (i + 1) // parts) for i in range(parts)]
+
+
+def run_in_chunks(function, n, workers=1):
+    # Calls function(start, end) over disjoint chunks of range(n). The sparse kernels release the GIL,
+    # so threads writing into disjoint slices of one shared output array scale across cores.
+    chunks = split_range(n, get_worker_count(workers))
+    if len(chunks) == 1:
+        function(*chunks[0])
+        return
+    with ThreadPoolExecutor(len(chunks)) as executor:
+        for future in [executor.submit(function, start, end) for start, end in chunks]:
+            future.result()
+
+
+def map_in_order(function, items, workers=1):
+    # Yields function(item) for every item in order. With several workers the calls run concurrently, but at most
+    # `workers` results are pending at a time, so results that are reduced as they arrive stay bounded in memory.
+    workers = min(get_worker_count(workers), len(items))
+    if workers <= 1:
+        yield from map(function, items)
+        return
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
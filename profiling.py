@@ -0,0 +1,55 @@
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+
+_disabled_stage = nullcontext()
+
+
+class Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.profiler.timings[self.name] += time.perf_counter() - self.start
+        self.profiler.calls[self.name] += 1
+
+
+class Profiler:
+    # Stage timers and counters for the hot paths. While disabled, stage() returns a shared no-op context manager
+    # and count() returns immediately, so instrumented code pays only an attribute check.
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.timings = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+
+    def reset(self):
+        self.timings.clear()
+        self.calls.clear()
+        self.counters.clear()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _disabled_stage
+        return Stage(self, name)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def report(self):
+        report = {"stages": {name: {"time": self.timings[name], "calls": self.calls[name]} for name in self.timings},
+                  "counters": dict(self.counters)}
+        for stage, counter in (("radon", "projected_angles"), ("backprojection", "backprojected_angles")):
+            if self.counters.get(counter):
+                report[stage + "_time_per_angle"] = self.timings.get(stage, 0) / self.counters[counter]
+        return report
+
+
+profiler = Profiler()
@@ -0,0 +1,600 @@
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+from math import sin, cos
+import numpy as np
+from scipy import sparse
+import backends
+import joseph
+import parallel
+from profiling import profiler
+
+
+class Point:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def get_coords(self, center, angle):
+        s = sin(angle)
+        c = cos(angle)
+        x = self.x - center.x
+        y = self.y - center.y
+        nx = x * c - y * s
+        ny = x * s + y * c
+        x = nx + center.x
+        y = ny + center.y
+        return Point(round(x), round(y))
+
+
+class SystemMatrix:
+    # Sparse operator mapping a flattened size x size image to a flattened sinogram, one row per
+    # (emitter angle, detector) ray. radon and inverse_radon place the scanner circle slightly
+    # differently, so each layout gets its own matrix. The "bresenham" projector gives unweighted nearest-pixel line
+    # sums; "joseph" weights two interpolated pixels per step by the intersection length. Weights are stored in
+    # `dtype`, and images and sinogram passed through the operator come out in it. With a region of interest (see
+    # get_roi_mask) rays are only traced across its bounding box and only pixels inside it are kept, so building and
+    # applying the matrix scales with the ROI; the rest of the image stays zero.
+    def __init__(self, size, emitter_angles, detector_quantity, span, layout="radon", matrix=None,
+                 projector="bresenham", dtype=float, roi=None):
+        self.size = int(size)
+        self.emitter_angles = np.asarray(emitter_angles, dtype=float)
+        self.detector_quantity = int(detector_quantity)
+        self.span = float(span)
+        self.layout = layout
+        self.projector = projector
+        self.dtype = np.dtype(dtype)
+        self.mask = get_roi_mask(self.size, roi)
+        self.key = geometry_key(self.size, self.emitter_angles, self.detector_quantity, self.span, layout, projector,
+                                self.dtype, self.mask)
+        self.matrix = (matrix if matrix is not None else self.build()).astype(self.dtype, copy=False)
+
+    def build(self, chunk_rays=1 << 16):
+        with profiler.stage("ray_tracing"):
+            matrix = self.trace_rays(chunk_rays)
+        profiler.count("rays_traced", matrix.shape[0])
+        return matrix
+
+    def trace_rays(self, chunk_rays):
+        if self.projector == "joseph":
+            return self.trace_rays_joseph(chunk_rays)
+        if self.projector != "bresenham":
+            raise ValueError("Unknown projector: %s" % self.projector)
+        angles_per_chunk = max(1, chunk_rays // self.detector_quantity)
+        indptr = [np.zeros(1, dtype=int)]
+        indices = []
+        for start in range(0, len(self.emitter_angles), angles_per_chunk):
+            angles = self.emitter_angles[start:start + angles_per_chunk]
+            sources, detectors = get_ray_endpoints(self.size, angles, self.detector_quantity, self.span, self.layout)
+            start = stop = None
+            if self.mask is not None:
+                start, stop = get_roi_steps(sources, detectors, get_roi_bounds(self.mask))
+            paths, offsets = backends.active.bresenham_batch(sources[0], sources[1], detectors[0], detectors[1],
+                                                             start, stop)
+            pixels = paths[:, 0] * self.size + paths[:, 1]
+            if self.mask is not None:
+                keep = self.mask.ravel()[pixels]
+                pixels, offsets = pixels[keep], np.concatenate(([0], np.cumsum(keep)))[offsets]
+            indices.append(pixels)
+            indptr.append(offsets[1:] + indptr[-1][-1])
+        indices = np.concatenate(indices)
+        data = np.ones(len(indices), dtype=self.dtype)
+        shape = (len(self.emitter_angles) * self.detector_quantity, self.size * self.size)
+        return sparse.csr_matrix((data, indices, np.concatenate(indptr)), shape=shape)
+
+    def trace_rays_joseph(self, chunk_rays):
+        angles_per_chunk = max(1, chunk_rays // self.detector_quantity)
+        blocks = []
+        for start in range(0, len(self.emitter_angles), angles_per_chunk):
+            angles = self.emitter_angles[start:start + angles_per_chunk]
+            sources, detectors = get_ray_endpoints(self.size, angles, self.detector_quantity, self.span, self.layout,
+                                                   rounded=False)
+            hit = None
+            if self.mask is not None:
+                # Endpoints are real-valued, so the rays can simply be cut to the ROI; the samples Joseph's method
+                # takes along the remaining segment are the same as along the whole ray.
+                t_enter, t_exit = clip_rays(sources, detectors, get_roi_bounds(self.mask))
+                hit = np.flatnonzero(t_enter <= t_exit)
+                begins = [begin[hit] for begin in sources]
+                deltas = [end[hit] - begin for begin, end in zip(begins, detectors)]
+                sources = [begin + t_enter[hit] * delta for begin, delta in zip(begins, deltas)]
+                detectors = [begin + t_exit[hit] * delta for begin, delta in zip(begins, deltas)]
+            rays, x, y, weights = joseph.joseph_weights(sources[0], sources[1], detectors[0], detectors[1], self.size)
+            if self.mask is not None:
+                keep = self.mask[x, y]
+                rays, x, y, weights = hit[rays[keep]], x[keep], y[keep], weights[keep]
+            blocks.append(sparse.csr_matrix((weights.astype(self.dtype), (rays, x * self.size + y)),
+                                            shape=(len(angles) * self.detector_quantity, self.size * self.size)))
+        return sparse.vstack(blocks, format="csr")
+
+    def angle_block(self, i):
+        d = self.detector_quantity
+        return row_block(self.matrix, i * d, (i + 1) * d)
+
+    def pixels_touched(self):
+        return self.matrix.nnz
+
+    def nbytes(self):
+        return self.matrix.data.nbytes + self.matrix.indices.nbytes + self.matrix.indptr.nbytes
+
+    def project(self, image, workers=1):
+        # Accepts one size x size image or a stack (..., size, size); a stack is gathered for all slices in one pass
+        # over the matrix.
+        image = np.asarray(image, dtype=self.dtype)
+        stack_shape = image.shape[:-2]
+        x = image.reshape(-1, self.size * self.size).T if stack_shape else image.ravel()
+        d = self.detector_quantity
+        if parallel.get_worker_count(workers) == 1:
+            sinogram = backends.active.gather_sum(self.matrix, x)
+        else:
+            sinogram = np.empty((self.matrix.shape[0],) + x.shape[1:], dtype=self.dtype)
+
+            def project_angles(start, end):
+                sinogram[start * d:end * d] = backends.active.gather_sum(row_block(self.matrix, start * d, end * d), x)
+
+            parallel.run_in_chunks(project_angles, len(self.emitter_angles), workers)
+        if stack_shape:
+            return np.ascontiguousarray(sinogram.T).reshape(stack_shape + (len(self.emitter_angles), d))
+        return sinogram.reshape(len(self.emitter_angles), d)
+
+    def project_angle(self, image, i):
+        return backends.active.gather_sum(self.angle_block(i), image.ravel())
+
+    def backproject(self, sinogram, workers=1):
+        sinogram = np.asarray(sinogram, dtype=self.dtype)
+        stack_shape = sinogram.shape[:-2]
+        x = sinogram.reshape(-1, self.matrix.shape[0]).T if stack_shape else sinogram.ravel()
+        # Angles are split into the same reduction_blocks blocks whatever the worker count. Every block is
+        # backprojected into its own partial image and the partial images are summed in block order, so serial and
+        # parallel runs give bit-identical images.
+        d = self.detector_quantity
+
+        def backproject_block(block):
+            start, end = block
+            return backends.active.scatter_add(row_block(self.matrix, start * d, end * d), x[start * d:end * d])
+
+        image = None
+        for partial in parallel.map_in_order(backproject_block,
+                                             parallel.split_range(len(self.emitter_angles), reduction_blocks),
+                                             workers):
+            if image is None:
+                image = partial
+            else:
+                image += partial
+        if stack_shape:
+            return np.ascontiguousarray(image.T).reshape(stack_shape + (self.size, self.size))
+        return image.reshape(self.size, self.size)
+
+    def angle_contributions(self, sinogram_projection, i):
+        block = self.angle_block(i)
+        return block.indices, block.data * np.repeat(sinogram_projection, np.diff(block.indptr))
+
+    def backproject_angle(self, sinogram_projection, i, image):
+        image += backends.active.scatter_add(self.angle_block(i), sinogram_projection).reshape(image.shape)
+        return image
+
+    def save(self, path):
+        # Written under a unique name and renamed, so concurrent processes never see a partial file.
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp.npz", delete=False) as f:
+            np.savez(f, data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+                     shape=np.array(self.matrix.shape))
+        os.replace(f.name, path)
+
+    @classmethod
+    def load(cls, path, size, emitter_angles, detector_quantity, span, layout, projector="bresenham", dtype=float,
+             roi=None):
+        with np.load(path) as f:
+            matrix = sparse.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+        return cls(size, emitter_angles, detector_quantity, span, layout, matrix=matrix, projector=projector,
+                   dtype=dtype, roi=roi)
+
+
+class ChunkedSystemMatrix:
+    # Stand-in for a SystemMatrix too large to hold in memory: the rows of one chunk of angles are loaded whenever
+    # they are needed and dropped again, so memory stays within chunk_budget. With a cache directory every chunk is
+    # traced once and stored under the geometry key and its angle range, and later passes and runs map it from disk;
+    # without one it is traced on every pass. Angles visited in order (interactive runs, snapshot rebuilds) load
+    # every chunk once. Same interface as SystemMatrix, without the CSR `matrix`.
+    def __init__(self, size, emitter_angles, detector_quantity, span, layout="radon", projector="bresenham",
+                 dtype=float, roi=None, chunk_budget=None, cache_dir=None):
+        self.size = int(size)
+        self.emitter_angles = np.asarray(emitter_angles, dtype=float)
+        self.detector_quantity = int(detector_quantity)
+        self.span = float(span)
+        self.layout = layout
+        self.projector = projector
+        self.dtype = np.dtype(dtype)
+        self.mask = get_roi_mask(self.size, roi)
+        self.key = geometry_key(self.size, self.emitter_angles, self.detector_quantity, self.span, layout, projector,
+                                self.dtype, self.mask)
+        angle_nbytes = estimate_angle_nbytes(self.size, self.emitter_angles, self.detector_quantity, self.span, layout,
+                                             projector, self.dtype, self.mask)
+        self.angles_per_chunk = max(1, int((chunk_budget or matrix_memory_budget // 8) // angle_nbytes))
+        # An operator larger than the disk cache would evict its own chunks before the next pass reads them.
+        self.cache_dir = cache_dir if len(self.emitter_angles) * angle_nbytes <= matrix_disk_budget else None
+        self.chunk = (None, None)
+        self.chunk_nnz = {}
+
+    def get_chunk(self, start):
+        chunk_start, matrix = self.chunk
+        if chunk_start != start:
+            self.chunk = (None, None)  # released before the next chunk is loaded
+            angles = self.emitter_angles[start:start + self.angles_per_chunk]
+            prefix = matrix = None
+            if self.cache_dir:
+                prefix = os.path.join(self.cache_dir, "%s-%d-%d" % (self.key, start, start + len(angles)))
+                matrix = load_matrix_arrays(prefix, (len(angles) * self.detector_quantity, self.size * self.size))
+            traced = matrix is None
+            matrix = SystemMatrix(self.size, angles, self.detector_quantity, self.span, self.layout, matrix=matrix,
+                                  projector=self.projector, dtype=self.dtype, roi=self.mask)
+            if prefix and traced:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                save_matrix_arrays(prefix, matrix.matrix)
+                evict_matrix_files(self.cache_dir)
+            self.chunk = (start, matrix)
+            self.chunk_nnz[start] = matrix.pixels_touched()
+        return matrix
+
+    def iter_chunks(self):
+        for start in range(0, len(self.emitter_angles), self.angles_per_chunk):
+            yield start, self.get_chunk(start)
+
+    def get_angle_chunk(self, i):
+        start = i - i % self.angles_per_chunk
+        return self.get_chunk(start), i - start
+
+    def pixels_touched(self):
+        # Exact once every chunk has been traced; extrapolated from the chunks traced so far until then.
+        if not self.chunk_nnz:
+            return 0
+        chunks_count = -(-len(self.emitter_angles) // self.angles_per_chunk)
+        return int(sum(self.chunk_nnz.values()) * chunks_count / len(self.chunk_nnz))
+
+    def project(self, image, workers=1):
+        image = np.asarray(image, dtype=self.dtype)
+        sinogram = np.empty(image.shape[:-2] + (len(self.emitter_angles), self.detector_quantity), dtype=self.dtype)
+        for start, chunk in self.iter_chunks():
+            sinogram[..., start:start + len(chunk.emitter_angles), :] = chunk.project(image, workers)
+        return sinogram
+
+    def project_angle(self, image, i):
+        chunk, j = self.get_angle_chunk(i)
+        return chunk.project_angle(image, j)
+
+    def backproject(self, sinogram, workers=1):
+        sinogram = np.asarray(sinogram, dtype=self.dtype)
+        image = np.zeros(sinogram.shape[:-2] + (self.size, self.size), dtype=self.dtype)
+        for start, chunk in self.iter_chunks():
+            image += chunk.backproject(sinogram[..., start:start + len(chunk.emitter_angles), :], workers)
+        return image
+
+    def angle_contributions(self, sinogram_projection, i):
+        chunk, j = self.get_angle_chunk(i)
+        return chunk.angle_contributions(sinogram_projection, j)
+
+    def backproject_angle(self, sinogram_projection, i, image):
+        chunk, j = self.get_angle_chunk(i)
+        return chunk.backproject_angle(sinogram_projection, j, image)
+
+
+class PixelBackprojector:
+    # Pixel-driven alternative to SystemMatrix.backproject: for every angle the detector coordinate of each pixel is
+    # found on the same scanner arc (the second intersection of the source->pixel line with the scanner circle) and
+    # the projection row is linearly interpolated there. Backprojection-only; same interface as SystemMatrix. With a
+    # region of interest only its pixels are computed.
+    def __init__(self, size, emitter_angles, detector_quantity, span, layout="inverse_radon", dtype=float, roi=None):
+        self.size = int(size)
+        self.emitter_angles = np.asarray(emitter_angles, dtype=float)
+        self.detector_quantity = int(detector_quantity)
+        self.span = float(span)
+        self.layout = layout
+        self.dtype = np.dtype(dtype)
+        center, base = get_scanner_circle(self.size, layout)
+        self.center = center
+        self.radius = np.hypot(base.x - center.x, base.y - center.y)
+        self.mask = get_roi_mask(self.size, roi)
+        self.pixels = slice(None) if self.mask is None else np.flatnonzero(self.mask)
+        x, y = np.meshgrid(np.arange(self.size), np.arange(self.size), indexing="ij")
+        self.x = x.ravel()[self.pixels] - center.x
+        self.y = y.ravel()[self.pixels] - center.y
+        self.detector_indexes = np.arange(self.detector_quantity)
+
+    def pixels_touched(self):
+        return len(self.emitter_angles) * len(self.x)
+
+    def detector_coordinates(self, i, pixels=slice(None)):
+        emitter_angle = self.emitter_angles[i]
+        source_x = self.radius * np.sin(emitter_angle)
+        source_y = -self.radius * np.cos(emitter_angle)
+        dx = self.x[pixels] - source_x
+        dy = self.y[pixels] - source_y
+        length = dx * dx + dy * dy
+        t = -2 * (source_x * dx + source_y * dy) / np.where(length > 0, length, 1)
+        arc_angle = np.arctan2(source_x + t * dx, -(source_y + t * dy))
+        first_detector = emitter_angle + np.pi - self.span / 2.0
+        return np.mod(arc_angle - first_detector, 2 * np.pi) / (self.span / self.detector_quantity)
+
+    def interpolate(self, sinogram_projection, i, pixels=slice(None)):
+        return np.interp(self.detector_coordinates(i, pixels), self.detector_indexes, sinogram_projection,
+                         left=0, right=0).astype(self.dtype, copy=False)
+
+    def backproject(self, sinogram, workers=1):
+        sinogram = np.asarray(sinogram)
+        if sinogram.ndim > 2:
+            return np.stack([self.backproject(s, workers) for s in sinogram])
+        image = np.zeros(self.size * self.size, dtype=self.dtype)
+        values = image if self.mask is None else np.zeros(len(self.x), dtype=self.dtype)
+
+        def backproject_pixels(start, end):
+            pixels = slice(start, end)
+            for i, sinogram_projection in enumerate(sinogram):
+                values[pixels] += self.interpolate(sinogram_projection, i, pixels)
+
+        parallel.run_in_chunks(backproject_pixels, len(self.x), workers)
+        if self.mask is not None:
+            image[self.pixels] = values
+        return image.reshape(self.size, self.size)
+
+    def angle_contributions(self, sinogram_projection, i):
+        values = self.interpolate(sinogram_projection, i)
+        nonzero = np.flatnonzero(values)
+        pixels = nonzero if self.mask is None else self.pixels[nonzero]
+        return pixels, values[nonzero]
+
+    def backproject_angle(self, sinogram_projection, i, image):
+        image.reshape(-1)[self.pixels] += self.interpolate(sinogram_projection, i)
+        return image
+
+
+_matrices = OrderedDict()
+reduction_blocks = 32
+matrix_memory_budget = 512 * 2 ** 20  # bytes of cached matrices; larger operators are traced in chunks
+matrix_disk_budget = 4 * 2 ** 30  # bytes of matrix files in a cache directory
+
+
+def row_block(matrix, start, end):
+    # Rows start:end of a CSR matrix as a view, without the copy made by matrix[start:end]. The arrays are assigned
+    # after construction because the constructor copies views of much larger arrays.
+    indptr = matrix.indptr
+    block = sparse.csr_matrix((end - start, matrix.shape[1]), dtype=matrix.dtype)
+    block.data = matrix.data[indptr[start]:indptr[end]]
+    block.indices = matrix.indices[indptr[start]:indptr[end]]
+    block.indptr = indptr[start:end + 1] - indptr[start]
+    return block
+
+
+def get_scanner_circle(size, layout):
+    if layout == "radon":
+        center = Point(size // 2, size // 2)
+        base = Point(size // 2, 1)
+    elif layout == "inverse_radon":
+        w = h = size - 5
+        center = Point(int(w / 2), int(h / 2))
+        base = Point(int(w / 2), 0)
+    else:
+        raise ValueError("Unknown scanner layout: %s" % layout)
+    return center, base
+
+
+def rotate_points(point, center, angles, rounded=True):
+    s = np.sin(angles)
+    c = np.cos(angles)
+    x = point.x - center.x
+    y = point.y - center.y
+    nx = x * c - y * s
+    ny = x * s + y * c
+    if not rounded:
+        return nx + center.x, ny + center.y
+    return np.round(nx + center.x).astype(int), np.round(ny + center.y).astype(int)
+
+
+def get_ray_endpoints(size, emitter_angles, detector_quantity, span, layout, rounded=True):
+    # Vectorized Point.get_coords for every (emitter angle, detector) pair, flattened in sinogram order.
+    center, base = get_scanner_circle(size, layout)
+    emitter_angles = np.asarray(emitter_angles, dtype=float)
+    detector_step = span / detector_quantity
+    halfspan = span / 2.0
+    detectors_angles = emitter_angles[:, None] + np.pi - halfspan + np.arange(detector_quantity) * detector_step
+    sources = rotate_points(base, center, np.repeat(emitter_angles, detector_quantity), rounded)
+    detectors = rotate_points(base, center, detectors_angles.ravel(), rounded)
+    return sources, detectors
+
+
+def get_roi_mask(size, roi):
+    # A region of interest is a (top, left, bottom, right) rectangle of rows and columns, bottom and right exclusive,
+    # or a size x size boolean mask. None stands for the whole image.
+    if roi is None:
+        return None
+    roi = np.asarray(roi)
+    if roi.shape == (size, size):
+        mask = roi.astype(bool)
+    elif roi.shape == (4,):
+        top, left, bottom, right = (int(v) for v in roi)
+        mask = np.zeros((size, size), dtype=bool)
+        mask[max(top, 0):bottom, max(left, 0):right] = True
+    else:
+        raise ValueError("ROI must be a (top, left, bottom, right) rectangle or a %dx%d mask" % (size, size))
+    if not mask.any():
+        raise ValueError("ROI is empty")
+    return mask
+
+
+def get_roi_bounds(mask):
+    rows = np.flatnonzero(mask.any(axis=1))
+    columns = np.flatnonzero(mask.any(axis=0))
+    return rows[0], columns[0], rows[-1] + 1, columns[-1] + 1
+
+
+def clip_rays(sources, detectors, bounds, margin=1.0):
+    # Liang-Barsky clipping: the fraction [t_enter, t_exit] of every source->detector segment that lies within
+    # `margin` pixels of the (top, left, bottom, right) bounds. Segments that miss them get t_enter > t_exit.
+    top, left, bottom, right = bounds
+    t_enter = np.zeros(len(sources[0]))
+    t_exit = np.ones(len(sources[0]))
+    for begin, end, low, high in zip(sources, detectors, (top - margin, left - margin),
+                                     (bottom - 1 + margin, right - 1 + margin)):
+        begin = np.asarray(begin, dtype=float)
+        delta = np.asarray(end, dtype=float) - begin
+        along = delta != 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t_low = (low - begin) / delta
+            t_high = (high - begin) / delta
+        outside = ~along & ((begin < low) | (begin > high))
+        t_enter = np.where(along, np.maximum(t_enter, np.minimum(t_low, t_high)), np.where(outside, 1, t_enter))
+        t_exit = np.where(along, np.minimum(t_exit, np.maximum(t_low, t_high)), np.where(outside, 0, t_exit))
+    return t_enter, t_exit
+
+
+def get_roi_steps(sources, detectors, bounds):
+    # Range of Bresenham steps start <= k < stop of every ray that can touch the bounds. A rasterized pixel is at most
+    # half a pixel off the exact line, which the one pixel clipping margin covers.
+    major = np.maximum(np.abs(detectors[0] - sources[0]), np.abs(detectors[1] - sources[1]))
+    t_enter, t_exit = clip_rays(sources, detectors, bounds)
+    start = np.clip(np.floor(t_enter * major), 0, major + 1).astype(int)
+    stop = np.clip(np.ceil(t_exit * major) + 1, 0, major + 1).astype(int)
+    return start, np.where(t_enter <= t_exit, stop, start)
+
+
+def geometry_key(size, emitter_angles, detector_quantity, span, layout, projector="bresenham", dtype=float,
+                 mask=None):
+    digest = hashlib.sha1()
+    digest.update(("%s:%s:%d:%d:%r:" % (layout, projector, size, detector_quantity, float(span))).encode())
+    digest.update(np.asarray(emitter_angles, dtype=float).tobytes())
+    if np.dtype(dtype) != np.float64:  # float64 keys predate the dtype setting and stay valid in existing caches
+        digest.update(np.dtype(dtype).str.encode())
+    if mask is not None:
+        digest.update(b"roi:" + np.packbits(mask).tobytes())
+    return digest.hexdigest()
+
+
+def get_system_matrix(size, emitter_angles, detector_quantity, span, layout="radon", cache_dir=None,
+                      keep_in_memory=True, projector="bresenham", dtype=float, roi=None, whole=False):
+    # An operator estimated to exceed matrix_memory_budget becomes a ChunkedSystemMatrix, unless `whole` asks for the
+    # complete CSR matrix (iterative methods index it directly). Cached matrices are evicted least recently used
+    # first to stay within the budget, in memory and on disk.
+    mask = get_roi_mask(size, roi)
+    if not whole and estimate_matrix_nbytes(size, emitter_angles, detector_quantity, span, layout, projector, dtype,
+                                            mask) > matrix_memory_budget:
+        return ChunkedSystemMatrix(size, emitter_angles, detector_quantity, span, layout, projector, dtype, mask,
+                                   cache_dir=cache_dir)
+    key = geometry_key(size, emitter_angles, detector_quantity, span, layout, projector, dtype, mask)
+    if key in _matrices:
+        _matrices.move_to_end(key)
+        return _matrices[key]
+    path = os.path.join(cache_dir, key + ".npz") if cache_dir else None
+    system_matrix = None
+    if path and os.path.exists(path):
+        try:
+            system_matrix = SystemMatrix.load(path, size, emitter_angles, detector_quantity, span, layout, projector,
+                                              dtype, roi)
+            os.utime(path)
+        except (OSError, ValueError):  # evicted by another process meanwhile
+            system_matrix = None
+    if system_matrix is None:
+        system_matrix = SystemMatrix(size, emitter_angles, detector_quantity, span, layout, projector=projector,
+                                     dtype=dtype, roi=roi)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            system_matrix.save(path)
+            evict_matrix_files(cache_dir)
+    if not keep_in_memory or system_matrix.nbytes() > matrix_memory_budget:
+        return system_matrix
+    _matrices[key] = system_matrix
+    while sum(matrix.nbytes() for matrix in _matrices.values()) > matrix_memory_budget:
+        _matrices.popitem(last=False)
+    return system_matrix
+
+
+def save_matrix_arrays(prefix, matrix):
+    # One uncompressed .npy file per CSR array, so that loading can map them instead of reading them. indptr is
+    # written last; each file is renamed into place like SystemMatrix.save.
+    for name in ("data", "indices", "indptr"):
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(prefix), suffix=".tmp.npy", delete=False) as f:
+            np.save(f, getattr(matrix, name))
+        os.replace(f.name, "%s.%s.npy" % (prefix, name))
+
+
+def load_matrix_arrays(prefix, shape):
+    # The CSR matrix written by save_matrix_arrays, memory-mapped read-only, or None if any part is missing.
+    try:
+        indptr, indices, data = (np.load("%s.%s.npy" % (prefix, name), mmap_mode="r")
+                                 for name in ("indptr", "indices", "data"))
+        for name in ("indptr", "indices", "data"):
+            os.utime("%s.%s.npy" % (prefix, name))
+    except (OSError, ValueError):  # not cached yet, or evicted by another process meanwhile
+        return None
+    if len(indptr) != shape[0] + 1 or not len(indices) == len(data) == indptr[-1]:
+        return None
+    matrix = sparse.csr_matrix(shape, dtype=data.dtype)
+    matrix.data, matrix.indices, matrix.indptr = data, indices, indptr  # the constructor would read them in
+    return matrix
+
+
+def evict_matrix_files(cache_dir, disk_budget=None):
+    # Least recently used first, like ResultCache.evict_files; loads touch the modification time. The files of one
+    # matrix (see save_matrix_arrays) share the part of the name before the first dot and are evicted together.
+    disk_budget = matrix_disk_budget if disk_budget is None else disk_budget
+    matrices = {}
+    for name in os.listdir(cache_dir):
+        if name.endswith((".npz", ".npy")) and not name.endswith((".tmp.npz", ".tmp.npy")):
+            path = os.path.join(cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files = matrices.setdefault(name.split(".")[0], [0, 0, []])
+            files[0] = max(files[0], stat.st_mtime)
+            files[1] += stat.st_size
+            files[2].append(path)
+    total = sum(nbytes for _, nbytes, _ in matrices.values())
+    for _, nbytes, paths in sorted(matrices.values()):
+        if total <= disk_budget:
+            break
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= nbytes
+
+
+def estimate_angle_nnz(size, emitter_angles, detector_quantity, span, layout, projector="bresenham", mask=None,
+                       samples=8):
+    # Pixels stored per angle, averaged over a few evenly spaced angles: a Bresenham ray takes one pixel per step
+    # along its major axis, Joseph's method two. With a region of interest only the steps across its bounding box
+    # are counted.
+    emitter_angles = np.asarray(emitter_angles, dtype=float)
+    emitter_angles = emitter_angles[np.linspace(0, len(emitter_angles) - 1, min(samples, len(emitter_angles)),
+                                                dtype=int)]
+    sources, detectors = get_ray_endpoints(size, emitter_angles, detector_quantity, span, layout)
+    if mask is None:
+        steps = np.maximum(np.abs(detectors[0] - sources[0]), np.abs(detectors[1] - sources[1])) + 1
+    else:
+        start, stop = get_roi_steps(sources, detectors, get_roi_bounds(mask))
+        steps = stop - start
+    return (2 if projector == "joseph" else 1) * steps.sum() / len(emitter_angles)
+
+
+def estimate_angle_nbytes(size, emitter_angles, detector_quantity, span, layout, projector="bresenham", dtype=float,
+                          mask=None):
+    # Every pixel is stored as a weight and an index, every ray as an index pointer.
+    index_bytes = np.dtype(np.int32).itemsize
+    return (estimate_angle_nnz(size, emitter_angles, detector_quantity, span, layout, projector, mask)
+            * (np.dtype(dtype).itemsize + index_bytes) + detector_quantity * index_bytes)
+
+
+def estimate_matrix_nbytes(size, emitter_angles, detector_quantity, span, layout, projector="bresenham", dtype=float,
+                           mask=None):
+    return len(emitter_angles) * estimate_angle_nbytes(size, emitter_angles, detector_quantity, span, layout,
+                                                       projector, dtype, mask)
+
+
+def get_backprojector(size, emitter_angles, detector_quantity, span, backprojection="ray", cache_dir=None,
+                      keep_in_memory=True, projector="bresenham", dtype=float, roi=None, whole=False):
+    if backprojection == "pixel":
+        return PixelBackprojector(size, emitter_angles, detector_quantity, span, dtype=dtype, roi=roi)
+    if backprojection != "ray":
+        raise ValueError("Unknown backprojection mode: %s" % backprojection)
+    return get_system_matrix(size, emitter_angles, detector_quantity, span, "inverse_radon", cache_dir,
+                             keep_in_memory, projector, dtype, roi, whole)
@@ -1,14 +1,19 @@
+import queue
 import sys
-from PyQt5.QtCore import Qt
+import time
+from collections import deque
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtWidgets import *
-from threading import Thread
-import matplotlib.animation as animation
 import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.widgets import RectangleSelector
+import ingest
+import iterative
+import scheduler
+import session
 import tomograph
-from skimage.io import imread
-from skimage.transform import rescale
+from profiling import profiler
 
 
 class Interface(QMainWindow):
@@ -24,17 +29,35 @@ class Interface(QMainWindow):
         self.detectors_quantity_input = None
         self.span_input = None
         self.interactive_mode_checkbox = None
+        self.profiling_checkbox = None
+        self.progressive_checkbox = None
         self.image_select = None
         self.filter_select = None
+        self.method_select = None
+        self.projector_select = None
         self.run_button = None
+        self.open_session_button = None
+        self.save_session_button = None
         self.slider = None
         self.plot = None
         self.scanner = None
         self.is_interactive = True
         self.result_table = None
         self.image_file_name = None
+        self.image_path = None
+        self.resolution_input = None
+        self.inscribed_checkbox = None
+        self.float32_checkbox = None
         self.current_row = 0
-        self.is_working = False
+        self.scheduler = None
+        self.job_timer = None
+        self.job_rows = {}
+        self.finished_jobs = {}
+        self.shown_result = None
+        self.session_frames = 64  # keyframes kept in a saved session
+        self.cache_dir = ".cache"
+        self.workers = 0  # all cores
+        self.metrics_interval = 0.04  # seconds between per-angle MSE evaluations
 
         self.setWindowTitle('Tomograph simulator')
         self.setGeometry(self.margin_left, self.margin_top, self.window_width, self.window_height)
@@ -46,29 +69,52 @@ class Interface(QMainWindow):
 
         self.init_interaction()
 
+        self.init_scheduler()
+
     def init_result_table(self):
         self.result_table = QTableWidget(self)
         self.result_table.move(30, 82)
         self.result_table.setRowCount(1)
-        self.result_table.setColumnCount(6)
-        self.result_table.setHorizontalHeaderLabels(["File", "Theta", "Detectors", "Span", "Filter", "MSE"])
+        self.result_table.setColumnCount(13)
+        self.result_table.setHorizontalHeaderLabels(["File", "Theta", "Detectors", "Span", "Filter", "MSE", "Status",
+                                                     "Time [s]", "Tracing [s]", "Rays", "Pixels", "Snapshots",
+                                                     "Copied [MB]"])
         self.result_table.setColumnWidth(0, 120)
         self.result_table.setColumnWidth(1, 50)
         self.result_table.setColumnWidth(2, 60)
         self.result_table.setColumnWidth(3, 50)
         self.result_table.setColumnWidth(4, 100)
         self.result_table.setColumnWidth(5, 80)
+        for i in range(6, 13):
+            self.result_table.setColumnWidth(i, 75)
         self.result_table.setFixedWidth(492)
         self.result_table.setFixedHeight(275)
+        self.result_table.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.result_table.customContextMenuRequested.connect(self.on_result_table_menu)
+        self.result_table.cellClicked.connect(self.on_result_table_clicked)
+
+    def init_scheduler(self):
+        # Runs are queued as jobs; a timer on the GUI thread collects their progress and results, so the window stays
+        # responsive while batch runs compute in worker processes.
+        self.scheduler = scheduler.JobScheduler(self.workers)
+        self.job_timer = QTimer()
+        self.job_timer.timeout.connect(self.poll_jobs)
+        self.job_timer.start(50)
 
     def init_interaction(self):
         self.add_theta_input()
         self.add_detectors_quantity_input()
         self.add_span_input()
         self.add_filter_select()
+        self.add_method_select()
         self.add_interactive_mode_checkbox()
+        self.add_profiling_checkbox()
+        self.add_progressive_checkbox()
+        self.add_projector_select()
         self.add_image_select()
+        self.add_ingest_options()
         self.add_run_button()
+        self.add_session_buttons()
         self.add_slider()
         self.add_labels()
 
@@ -106,28 +152,82 @@ class Interface(QMainWindow):
         filter_label = QLabel("Select filter:", self)
         filter_label.move(x, self.first_row_top_margin_label)
         self.filter_select = QComboBox(self)
-        self.filter_select.addItems(['None', 'Ramp', 'Shepp-Logan', 'Cosine', 'Hamming', 'Han'])
+        self.filter_select.addItems(['None', 'Ramp', 'Shepp-Logan', 'Cosine', 'Hamming', 'Han', 'Fourier'])
         self.filter_select.move(x, self.first_row_top_margin_input)
 
-    def add_interactive_mode_checkbox(self):
+    def add_method_select(self):
         x = Interface.get_x_window_position(4)
+        method_label = QLabel("Method:", self)
+        method_label.move(x, self.first_row_top_margin_label)
+        self.method_select = QComboBox(self)
+        self.method_select.addItems(['FBP'] + iterative.methods)
+        self.method_select.move(x, self.first_row_top_margin_input)
+
+    def add_interactive_mode_checkbox(self):
+        x = Interface.get_x_window_position(5)
         self.interactive_mode_checkbox = QCheckBox('Interactive\nmode', self)
         self.interactive_mode_checkbox.setChecked(self.is_interactive)
         self.interactive_mode_checkbox.move(x, self.first_row_top_margin_input)
 
+    def add_profiling_checkbox(self):
+        x = Interface.get_x_window_position(8)
+        self.profiling_checkbox = QCheckBox('Profiling', self)
+        self.profiling_checkbox.setChecked(profiler.enabled)
+        self.profiling_checkbox.move(x, self.first_row_top_margin_input)
+
+    def add_progressive_checkbox(self):
+        x = Interface.get_x_window_position(8)
+        self.progressive_checkbox = QCheckBox('Progressive', self)
+        self.progressive_checkbox.move(x, self.first_row_top_margin_label)
+
+    def add_projector_select(self):
+        x = Interface.get_x_window_position(9)
+        projector_label = QLabel("Projector:", self)
+        projector_label.move(x, self.first_row_top_margin_label)
+        self.projector_select = QComboBox(self)
+        self.projector_select.addItems(['bresenham', 'joseph'])
+        self.projector_select.move(x, self.first_row_top_margin_input)
+
     def add_image_select(self):
-        x = Interface.get_x_window_position(5)
+        x = Interface.get_x_window_position(6)
         self.image_select = QPushButton('Select image', self)
         self.image_select.clicked.connect(self.on_image_select_clicked)
         self.image_select.move(x, self.first_row_top_margin_input)
 
+    def add_ingest_options(self):
+        self.float32_checkbox = QCheckBox('float32', self)
+        self.float32_checkbox.setFixedWidth(100)
+        self.float32_checkbox.move(160, 55)
+        self.inscribed_checkbox = QCheckBox('Inscribed', self)
+        self.inscribed_checkbox.setFixedWidth(100)
+        self.inscribed_checkbox.move(260, 55)
+        resolution_label = QLabel("Size:", self)
+        resolution_label.move(405, 58)
+        self.resolution_input = QSpinBox(self)
+        self.resolution_input.setRange(0, 4096)
+        self.resolution_input.setSingleStep(50)
+        self.resolution_input.setSpecialValueText("Original")
+        self.resolution_input.move(450, 55)
+        self.resolution_input.setFixedWidth(72)
+
     def add_run_button(self):
-        x = Interface.get_x_window_position(6)
+        x = Interface.get_x_window_position(7)
         self.run_button = QPushButton('Run', self)
         self.run_button.setDisabled(True)
         self.run_button.clicked.connect(self.run_task)
         self.run_button.move(x, self.first_row_top_margin_input)
 
+    def add_session_buttons(self):
+        self.open_session_button = QPushButton('Open session', self)
+        self.open_session_button.clicked.connect(self.on_open_session_clicked)
+        self.open_session_button.move(Interface.get_x_window_position(6), 3)
+        self.open_session_button.setFixedHeight(24)
+        self.save_session_button = QPushButton('Save session', self)
+        self.save_session_button.setDisabled(True)
+        self.save_session_button.clicked.connect(self.on_save_session_clicked)
+        self.save_session_button.move(Interface.get_x_window_position(7), 3)
+        self.save_session_button.setFixedHeight(24)
+
     def add_slider(self):
         self.slider = QSlider(Qt.Vertical, self)
         self.slider.move(924, 82)
@@ -143,8 +243,8 @@ class Interface(QMainWindow):
         result_table_label = QLabel('Results:', self)
         result_table_label.setFixedWidth(200)
         result_table_label.move(30, 58)
-        image_label = QLabel('Original image:', self)
-        image_label.setFixedWidth(200)
+        image_label = QLabel('Original image (drag to select ROI):', self)
+        image_label.setFixedWidth(300)
         image_label.move(617, 58)
         image_reconstructed_label = QLabel('Reconstructed image:', self)
         image_reconstructed_label.setFixedWidth(200)
@@ -154,57 +254,203 @@ class Interface(QMainWindow):
         sinogram_label.move(1078, 58)
 
     def on_image_select_clicked(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, 'Select image', '', "Images (*.png *.jpeg *.jpg *.bmp)")
+        file_path, _ = QFileDialog.getOpenFileName(self, 'Select image', '',
+                                                   "Images (*.png *.jpeg *.jpg *.bmp *.tif *.tiff *.npy *.raw)")
         if file_path:
-            image = imread(file_path, as_gray=True)
-            #image = rescale(image, scale=0.4)
-            self.plot.image = make_image_square(image)
-            self.plot.ax1.imshow(self.plot.image, cmap="gray")
-            self.plot.draw()
+            self.image_path = file_path
+            self.load_image()
             self.image_file_name = file_path.split("/")[-1]
             self.run_button.setDisabled(False)
 
+    def load_image(self):
+        # Ingested images are cached, so reloading with unchanged options on every run is free.
+        mode = "inscribed" if self.inscribed_checkbox.isChecked() else "pad"
+        image = ingest.load_image(self.image_path, self.resolution_input.value() or None, mode, dtype=self.get_dtype())
+        if image is not self.plot.image:
+            self.plot.image = image
+            self.plot.ax1.imshow(self.plot.image, cmap="gray")
+            self.plot.clear_roi()
+            self.plot.draw()
+
     def on_slider_value_change(self):
         value = self.slider.value()
         self.scanner.get_snapshot(value)
 
-    def add_row_to_table(self, file, theta, detectors, span, filter_type, mse):
-        for i, cell_value in enumerate([file, theta, detectors, span, filter_type, mse]):
+    def add_row_to_table(self, file, theta, detectors, span, filter_type, status):
+        for i, cell_value in enumerate([file, theta, detectors, span, filter_type, "", status]):
             self.result_table.setItem(self.current_row, i, QTableWidgetItem(str(cell_value)))
         self.current_row += 1
         self.result_table.setRowCount(self.current_row + 1)
+        return self.current_row - 1
+
+    def fill_row(self, row, mse, profile=None):
+        cells = [round(mse, 10), "finished"]
+        if profile is not None:
+            stages = profile["stages"]
+            counters = profile["counters"]
+            cells += [round(stages.get("total", {}).get("time", 0), 3),
+                      round(stages.get("ray_tracing", {}).get("time", 0), 3),
+                      counters.get("rays_traced", 0), counters.get("pixels_touched", 0),
+                      counters.get("snapshots_stored", 0), round(counters.get("bytes_copied", 0) / 2 ** 20, 1)]
+        for i, cell_value in enumerate(cells, 5):
+            self.result_table.setItem(row, i, QTableWidgetItem(str(cell_value)))
+
+    def set_row_status(self, row, status):
+        self.result_table.setItem(row, 6, QTableWidgetItem(status))
+
+    def get_dtype(self):
+        return "float32" if self.float32_checkbox.isChecked() else "float64"
 
     def run_task(self):
+        # Queues a job with the current settings. Interactive jobs animate the plots one at a time; the others run in
+        # worker processes, one core each, and fill their table row when they finish.
+        if self.image_path is not None:
+            self.load_image()
+        is_interactive = self.interactive_mode_checkbox.isChecked()
+        profiler.enabled = self.scheduler.profile = self.profiling_checkbox.isChecked()
+        params = tomograph.TomographParameters(self.plot.image, self.theta_input.value(),
+                                               self.detectors_quantity_input.value(), self.span_input.value(),
+                                               self.filter_select.currentText(), cache_dir=self.cache_dir,
+                                               workers=self.workers if is_interactive else 1,
+                                               method=self.method_select.currentText(),
+                                               metrics_interval=self.metrics_interval,
+                                               projector=self.projector_select.currentText(),
+                                               progressive=self.progressive_checkbox.isChecked(),
+                                               dtype=self.get_dtype(), roi=self.plot.roi, result_cache=True)
+        job = self.scheduler.submit(scheduler.Job(params, interactive=is_interactive, plot=self.plot,
+                                                  name=self.image_file_name))
+        filter_type = params.filter_type if params.method == "FBP" else params.method
+        self.job_rows[job.id] = self.add_row_to_table(job.name, params.theta_deg, params.detector_quantity,
+                                                      params.span_deg, filter_type, "queued")
+        self.poll_jobs()
+
+    def poll_jobs(self):
+        for job, event, payload in self.scheduler.poll():
+            row = self.job_rows[job.id]
+            if event == "running" and job.interactive:
+                self.start_interactive_job(job)
+                self.set_row_status(row, "running")
+            elif event in ("running", "progress"):
+                self.set_row_status(row, "running %d%%" % (100 * job.progress))
+            elif event == "finished":
+                self.finish_job(job, row)
+            else:
+                self.set_row_status(row, event)
+
+    def start_interactive_job(self, job):
         self.slider.setDisabled(True)
-        self.run_button.setDisabled(True)
-        self.image_select.setDisabled(True)
-        self.plot.update_mse(0)
-        self.is_interactive = self.interactive_mode_checkbox.isChecked()
-        tomograph.params.set_parameters(self.plot.image, self.theta_input.value(),
-                                        self.detectors_quantity_input.value(),
-                                        self.span_input.value(), self.filter_select.currentText())
-        self.scanner = tomograph.Tomograph(tomograph.params, self.plot, self.is_interactive)
-        self.plot.initialize_scan(self.scanner, self.is_interactive)
-        if self.is_interactive:
-            Thread(target=lambda: self.scanner.image_reconstruction(self.on_finish_task)).start()
-        else:
-            self.scanner.image_reconstruction(self.on_finish_task)
+        self.scanner = job.scanner
+        self.plot.initialize_scan(self.scanner, True)
 
-    def on_finish_task(self):
-        self.run_button.setDisabled(False)
-        self.image_select.setDisabled(False)
-        if self.is_interactive:
+    def finish_job(self, job, row):
+        if job.interactive:
             self.slider.setDisabled(False)
+            final = job.scanner.result
+            result = {"sinogram": final.sinogram, "image_reconstructed": final.image_reconstructed,
+                      "mse": final.mse_error, "profile": job.scanner.profile}
+            self.keep_history(result, job.scanner)
+            self.shown_result = result
+            self.save_session_button.setDisabled(False)
         else:
-            self.plot.ax2.imshow(self.scanner.sinogram, cmap="gray", animated=True)
-            self.plot.ax2.invert_yaxis()
-            self.plot.ax3.imshow(self.scanner.image_reconstructed, cmap="gray", animated=True)
-            self.plot.ax_err.plot(self.scanner.mse_data, 'b')
-            self.plot.draw()
-            self.plot.update_mse(self.scanner.mse_error)
-        self.add_row_to_table(self.image_file_name, tomograph.params.theta_deg, tomograph.params.detector_quantity,
-                              tomograph.params.span_deg, tomograph.params.filter_type,
-                              round(self.scanner.mse_error, 10))
+            result = job.result
+            if self.scheduler.interactive_job is None:
+                self.show_result(result)
+        result.update(params=job.params, name=job.name)
+        self.finished_jobs[row] = result
+        self.fill_row(row, result["mse"], result["profile"])
+
+    def get_row_job(self, row):
+        for job in self.scheduler.jobs:
+            if self.job_rows[job.id] == row:
+                return job
+        return None
+
+    def on_result_table_clicked(self, row, _):
+        result = self.finished_jobs.get(row)
+        if result is not None and self.scheduler.interactive_job is None:
+            self.show_result(result)
+
+    def keep_history(self, result, scanner):
+        # Snapshot histories can take hundreds of MB, so only the latest interactive run or session keeps its own. A
+        # reopened session's history reads from its archive, which is closed along with it.
+        for other in self.finished_jobs.values():
+            other.pop("scanner", None)
+            opened = other.pop("session", None)
+            if opened is not None:
+                opened.close()
+        result["scanner"] = scanner
+
+    def show_result(self, result):
+        # The snapshot slider only browses a result that still has its history.
+        scanner = result.get("scanner")
+        if scanner is not None and scanner.history is not None:
+            self.scanner = scanner
+            self.plot.initialize_scan(scanner, True)
+            scanner.progress.put(("sinogram", None))
+            scanner.progress.put(("image", None))
+            self.slider.setDisabled(False)
+        else:
+            self.slider.setDisabled(True)
+            self.plot.show_results(result["sinogram"], result["image_reconstructed"], result["mse"])
+        self.shown_result = result
+        self.save_session_button.setDisabled(False)
+
+    def on_save_session_clicked(self):
+        result = self.shown_result
+        file_path, _ = QFileDialog.getSaveFileName(self, 'Save session', (result["name"] or "session") + ".npz",
+                                                   "Sessions (*.npz)")
+        if not file_path:
+            return
+        if "scanner" in result:
+            session.save_tomograph(file_path, result["scanner"], result["name"], self.session_frames)
+        else:
+            session.save_session(file_path, result["params"], result["sinogram"], result["image_reconstructed"],
+                                 result["mse"], name=result["name"])
+
+    def on_open_session_clicked(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, 'Open session', '', "Sessions (*.npz)")
+        if file_path:
+            self.open_session(file_path)
+
+    def open_session(self, file_path):
+        # Shows a saved run without recomputing it; the slider scrubs its stored history.
+        if self.scheduler.interactive_job is not None:
+            return
+        opened = session.Session(file_path, self.cache_dir)
+        self.scanner = opened.open_tomograph(self.plot)
+        self.plot.image = self.scanner.image
+        self.plot.ax1.imshow(self.plot.image, cmap="gray")
+        self.plot.clear_roi()
+        self.plot.initialize_scan(self.scanner, True)
+        self.slider.setDisabled(self.scanner.history is None)
+        params = self.scanner.params
+        filter_type = params.filter_type if params.method == "FBP" else params.method
+        row = self.add_row_to_table(opened.parameters["name"], params.theta_deg, params.detector_quantity,
+                                    params.span_deg, filter_type, "")
+        self.fill_row(row, self.scanner.mse_error)
+        self.set_row_status(row, "session")
+        final = self.scanner.result
+        result = {"sinogram": final.sinogram, "image_reconstructed": final.image_reconstructed,
+                  "mse": final.mse_error, "profile": None, "params": params, "name": opened.parameters["name"],
+                  "session": opened}
+        self.keep_history(result, self.scanner)
+        self.finished_jobs[row] = self.shown_result = result
+        self.save_session_button.setDisabled(False)
+
+    def on_result_table_menu(self, position):
+        job = self.get_row_job(self.result_table.rowAt(position.y()))
+        if job is None:
+            return
+        menu = QMenu(self.result_table)
+        cancel_action = menu.addAction("Cancel")
+        run_next_action = menu.addAction("Run next")
+        run_next_action.setEnabled(job.state == "pending")
+        action = menu.exec_(self.result_table.viewport().mapToGlobal(position))
+        if action == cancel_action:
+            self.scheduler.cancel(job)
+        elif action == run_next_action:
+            self.scheduler.set_priority(job, min(pending.priority for pending in self.scheduler.get_pending()) - 1)
+        self.poll_jobs()
 
     @staticmethod
     def get_x_window_position(index):
@@ -220,15 +466,19 @@ class PlotCanvas(FigureCanvas):
         self.ax2 = plt.subplot2grid((2, 5), (0, 4), rowspan=2, colspan=1)  # sinogram
         self.ax3 = plt.subplot2grid((2, 5), (1, 2), rowspan=1, colspan=2)  # image_reconstructed
         self.ax_err = plt.subplot2grid((2, 5), (1, 0), colspan=2, rowspan=1)
-        self.im2 = self.im3 = self.im_err = None
-        self.ani2 = self.ani3 = self.ani_err = None
+        self.im2 = self.im3 = self.line_err = None
+        self.roi = self.roi_selector = None
+        self.backgrounds = None
+        self.render_loop = None
         self.scanner = None
         self.image = None
         self.mse_label = None
+        self.render_label = None
         self.mse_ylim = 0.41
         FigureCanvas.__init__(self, self.fig)
         self.setParent(interface)
         self.add_mse_label(interface)
+        self.add_render_label(interface)
         FigureCanvas.setSizePolicy(self, QSizePolicy.Expanding, QSizePolicy.Expanding)
         FigureCanvas.updateGeometry(self)
         self.move(-70, -20)
@@ -237,84 +487,175 @@ class PlotCanvas(FigureCanvas):
         self.ax3.set_axis_off()
         zeros = np.zeros((400, 400))
         self.ax1.imshow(zeros, cmap="gray")
-        self.im2 = self.ax2.imshow(zeros, cmap="gray", animated=True)
+        self.im2 = self.ax2.imshow(zeros, cmap="gray", origin="lower", animated=True)
         self.im3 = self.ax3.imshow(zeros, cmap="gray", animated=True)
+        self.ax_err.set_ylim([0, self.mse_ylim])
+        self.ax_err.set_yticks(np.arange(0, self.mse_ylim, 0.05))
+        [self.line_err] = self.ax_err.plot([], [], 'b', animated=True)
+        self.render_loop = RenderLoop(self)
+        self.mpl_connect("draw_event", self.on_draw)
+        self.roi_selector = RectangleSelector(self.ax1, self.on_roi_select, useblit=True, interactive=True,
+                                              ignore_event_outside=True)
 
     def add_mse_label(self, interface):
         self.mse_label = QLabel('Mean Squared Error: 0', interface)
         self.mse_label.move(57, 358)
         self.mse_label.setFixedWidth(200)
 
+    def add_render_label(self, interface):
+        self.render_label = QLabel('', interface)
+        self.render_label.move(300, 358)
+        self.render_label.setFixedWidth(200)
+
     def initialize_scan(self, scanner, is_interactive):
+        self.render_loop.stop()
         self.scanner = scanner
         zeros = np.zeros((400, 400))
-        self.im2 = self.ax2.imshow(zeros, cmap="gray", animated=True)
-        self.im3 = self.ax3.imshow(zeros, cmap="gray", animated=True)
-        self.ax_err.clear()
-        self.ax_err.set_ylim([0, self.mse_ylim])
-        self.ax_err.set_yticks(np.arange(0, self.mse_ylim, 0.05))
-        sinogram_iterations_num = len(tomograph.params.emitter_angles)
+        self.set_image(self.im2, zeros)
+        self.set_image(self.im3, zeros)
+        self.line_err.set_data([], [])
+        sinogram_iterations_num = scanner.get_steps_count()
         self.ax_err.set_xlim([0, sinogram_iterations_num])
-        self.ax_err.set_xticks(np.arange(0, sinogram_iterations_num + 1, sinogram_iterations_num // 5))
-        self.im_err = self.ax_err
+        self.ax_err.set_xticks(np.arange(0, sinogram_iterations_num + 1, max(1, sinogram_iterations_num // 5)))
         self.draw()
         self.update_mse(0)
-        if self.ani2 is not None:
-            self.ani2.event_source.stop()
-        if self.ani3 is not None:
-            self.ani3.event_source.stop()
-        if self.ani_err is not None:
-            self.ani_err.event_source.stop()
-        self.ani3 = self.ani2 = self.ani_err = None
+        self.render_label.setText('')
         if is_interactive:
-            self.ani2 = animation.FuncAnimation(self.fig, self.animation_sinogram_update, interval=25,
-                                                blit=True)  # sinogram animation
-            self.ani3 = animation.FuncAnimation(self.fig, self.animation_image_reconstructed_update, interval=25,
-                                                blit=True)  # image_reconstructed animation
-            self.ani_err = animation.FuncAnimation(self.fig, self.animation_error_update, interval=25,
-                                                   blit=True)  # mse animation
-
-    def put_sinogram_in_animation_buf(self, sinogram):
-        self.im2 = self.ax2.imshow(sinogram, cmap="gray", animated=True)
-        self.ax2.invert_yaxis()
-
-    def put_image_reconstructed_in_animation_buf(self, image_reconstructed):
-        self.im3 = self.ax3.imshow(image_reconstructed, cmap="gray", animated=True)
-
-    def animation_sinogram_update(self, _):
-        if self.scanner.refresh_sinogram:
-            self.scanner.refresh_sinogram = False
-            self.animation_update_element(self.im2, self.scanner.sinogram)
-        return self.im2,
-
-    def animation_image_reconstructed_update(self, _):
-        if self.scanner.refresh_image_reconstructed:
-            self.scanner.refresh_image_reconstructed = False
-            self.animation_update_element(self.im3, self.scanner.image_reconstructed)
-            self.update_mse(self.scanner.mse_error)
-        return self.im3,
-
-    def animation_error_update(self, _):
-        [self.im_err] = self.ax_err.plot(self.scanner.mse_data, 'b')
-        return self.im_err,
+            self.render_loop.start()
+
+    def on_roi_select(self, *_):
+        # Pixels whose centers lie in the dragged rectangle, as (top, left, bottom, right); a click clears the ROI.
+        left, right, top, bottom = self.roi_selector.extents
+        size = self.image.shape[0] if self.image is not None else 0
+        roi = (int(np.ceil(top)), int(np.ceil(left)), int(np.floor(bottom)) + 1, int(np.floor(right)) + 1)
+        roi = tuple(min(max(value, 0), size) for value in roi)
+        if roi[2] - roi[0] < 2 or roi[3] - roi[1] < 2:
+            self.clear_roi()
+            return
+        self.roi = roi
+
+    def clear_roi(self):
+        self.roi = None
+        self.roi_selector.set_visible(False)
+        self.draw_idle()
+
+    def on_draw(self, _):
+        # A full draw leaves out the animated artists; cache the backgrounds they are blitted onto and draw them.
+        self.backgrounds = {ax: self.copy_from_bbox(ax.bbox) for ax in (self.ax2, self.ax3, self.ax_err)}
+        for artist in (self.im2, self.im3, self.line_err):
+            artist.axes.draw_artist(artist)
+
+    def render_frame(self):
+        # Drains the scanner's progress events, pushes the arrays they name into the existing artists and blits only
+        # their axes. Returns the events drawn; an array changed by several of them only shows the last.
+        scanner = self.scanner
+        events = []
+        while True:
+            try:
+                events.append(scanner.progress.get_nowait())
+            except queue.Empty:
+                break
+        changed = {kind for kind, _ in events}
+        dirty = []
+        relayout = False
+        with profiler.stage("rendering"):
+            if "sinogram" in changed:
+                relayout |= self.set_image(self.im2, scanner.sinogram)
+                dirty.append(self.im2)
+            if "image" in changed:
+                relayout |= self.set_image(self.im3, scanner.image_reconstructed)
+                # The compute thread appends to both lists one after the other, so they can differ by one here.
+                steps, data = scanner.mse_steps, scanner.mse_data
+                n = min(len(steps), len(data))
+                self.line_err.set_data(steps[:n], data[:n])
+                self.update_mse(scanner.mse_error)
+                dirty += [self.im3, self.line_err]
+            if not dirty:
+                return events
+            if relayout or self.backgrounds is None:
+                self.draw()
+                return events
+            for artist in dirty:
+                ax = artist.axes
+                self.restore_region(self.backgrounds[ax])
+                ax.draw_artist(artist)
+                self.blit(ax.bbox)
+        return events
+
+    def show_results(self, sinogram, image_reconstructed, mse_error):
+        self.render_loop.stop()
+        self.set_image(self.im2, sinogram)
+        self.set_image(self.im3, image_reconstructed)
+        self.line_err.set_data([], [])
+        self.draw()
+        self.update_mse(mse_error)
 
     @staticmethod
-    def animation_update_element(im, data):
+    def set_image(im, data):
+        # Updates an image artist in place. Returns True when the shape changed, which moves the axes limits and
+        # needs a full redraw.
+        relayout = im.get_array().shape != data.shape
         im.set_data(data)
         im.norm.autoscale(data)
+        if relayout:
+            height, width = data.shape
+            rows = (-0.5, height - 0.5) if im.origin == "lower" else (height - 0.5, -0.5)
+            im.set_extent((-0.5, width - 0.5) + rows)
+            im.axes.set_xlim(-0.5, width - 0.5)
+            im.axes.set_ylim(*rows)
+        return relayout
 
     def update_mse(self, value):
         self.mse_label.setText("Mean Squared Error: %f" % value)
 
-
-def make_image_square(image_original):
-    diagonal = np.sqrt(2) * max(image_original.shape)
-    pad = [int(np.ceil(diagonal - s)) for s in image_original.shape]
-    new_center = [(s + p) // 2 for s, p in zip(image_original.shape, pad)]
-    old_center = [s // 2 for s in image_original.shape]
-    pad_before = [nc - oc for oc, nc in zip(old_center, new_center)]
-    pad_width = [(pb, p - pb) for pb, p in zip(pad_before, pad)]
-    return np.pad(image_original, pad_width, mode='constant', constant_values=0)
+    def update_render_stats(self, fps, dropped_frames):
+        self.render_label.setText("FPS: %d, dropped frames: %d" % (fps, dropped_frames))
+
+
+class RenderLoop:
+    # One frame-rate-capped timer drives all live plots. Scanner steps published faster than frames are coalesced
+    # into the next frame and counted as dropped, and the timer backs off when a frame takes longer than its budget,
+    # so rendering never takes more than about half of the GUI thread away from the compute thread.
+    def __init__(self, canvas, max_fps=30):
+        self.canvas = canvas
+        self.frame_interval = 1 / max_fps
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.tick)
+        self.running = False
+        self.frame_times = deque()
+        self.frames_rendered = 0
+        self.dropped_frames = 0
+
+    def start(self):
+        self.frame_times.clear()
+        self.frames_rendered = self.dropped_frames = 0
+        self.running = True
+        self.timer.start(0)
+
+    def stop(self):
+        self.running = False
+        self.timer.stop()
+
+    def fps(self):
+        return len(self.frame_times)
+
+    def tick(self):
+        # The timer is single-shot, so it is restarted even when a frame fails; otherwise the plots would freeze.
+        start = time.perf_counter()
+        try:
+            events = self.canvas.render_frame()
+            if events:
+                self.dropped_frames += len(events) - len({kind for kind, _ in events})
+                self.frames_rendered += 1
+                self.frame_times.append(start)
+            while self.frame_times and start - self.frame_times[0] > 1:
+                self.frame_times.popleft()
+            self.canvas.update_render_stats(self.fps(), self.dropped_frames)
+        finally:
+            elapsed = time.perf_counter() - start
+            if self.running:
+                self.timer.start(int(1000 * max(self.frame_interval - elapsed, elapsed)))
 
 
 if __name__ == '__main__':
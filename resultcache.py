@@ -0,0 +1,151 @@
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+import numpy as np
+import projection
+
+max_memory = 512 * 2 ** 20
+max_disk = 2 * 2 ** 30
+
+_caches = {}
+
+
+class ResultCache:
+    # Two-level LRU store of intermediate results: arrays in memory up to memory_budget bytes, and, with a directory,
+    # .npy files on disk up to disk_budget bytes, so other processes and later sessions share them. Entries never
+    # change once written, since keys are derived from everything that determines their content; returned arrays
+    # are shared and therefore read-only. put() takes ownership of a freshly computed array and makes it read-only in
+    # place; views and memory maps are copied, since their memory belongs to someone else.
+    def __init__(self, directory=None, memory_budget=max_memory, disk_budget=max_disk):
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.entries = OrderedDict()
+        self.memory_bytes = 0
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        path = self.get_path(key)
+        if path and os.path.exists(path):
+            try:
+                array = np.load(path)
+            except (OSError, ValueError):  # evicted by another process meanwhile
+                array = None
+            if array is not None:
+                os.utime(path)
+                self.hits += 1
+                return self.remember(key, array)
+        self.misses += 1
+        return None
+
+    def put(self, key, array):
+        if type(array) is not np.ndarray or not array.flags.owndata:
+            array = np.array(array)
+        array = self.remember(key, array)
+        path = self.get_path(key)
+        if path and array.nbytes <= self.disk_budget and not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp.npy", delete=False) as f:
+                np.save(f, array)
+            os.replace(f.name, path)
+            self.evict_files()
+        return array
+
+    def remember(self, key, array):
+        array.setflags(write=False)
+        if array.nbytes > self.memory_budget:
+            return array
+        if key in self.entries:
+            self.memory_bytes -= self.entries.pop(key).nbytes
+        self.entries[key] = array
+        self.memory_bytes += array.nbytes
+        while self.memory_bytes > self.memory_budget:
+            _, evicted = self.entries.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+        return array
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + ".npy") if self.directory else None
+
+    def evict_files(self):
+        # Least recently used first; reads touch the modification time.
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy") and not name.endswith(".tmp.npy"):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_budget:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.memory_bytes = 0
+
+
+def get_cache(cache_dir=None):
+    # One cache per directory and process; results live in a "results" subdirectory next to the cached matrices.
+    directory = os.path.join(cache_dir, "results") if cache_dir else None
+    if directory not in _caches:
+        _caches[directory] = ResultCache(directory)
+    return _caches[directory]
+
+
+def get_image_hash(image):
+    image = np.ascontiguousarray(image)
+    digest = hashlib.sha1(("%s:%s:" % (image.shape, image.dtype.str)).encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def get_keys(image_hash, size, params):
+    # Every level's key extends the previous one with the settings that level adds: the sinogram depends on the
+    # image and the forward geometry, the filtered sinogram on the filter, and the reconstruction on the method and
+    # the backprojection geometry (including the ROI).
+    def extend(key, *fields):
+        return hashlib.sha1(repr((key,) + fields).encode()).hexdigest()
+
+    forward = projection.geometry_key(size, params.emitter_angles, params.detector_quantity, params.span, "radon",
+                                      params.projector, params.dtype)
+    backward = projection.geometry_key(size, params.emitter_angles, params.detector_quantity, params.span,
+                                       "inverse_radon", params.projector, params.dtype, params.get_roi_mask(size))
+    sinogram = extend(image_hash, "sinogram", forward)
+    filtered = extend(sinogram, "filtered", params.filter_type)
+    reconstruction = extend(filtered, "reconstruction", params.method, params.iterations, params.subsets,
+                            params.tolerance, params.backprojection, backward)
+    return {"sinogram": sinogram, "filtered": filtered, "reconstruction": reconstruction}
+
+
+class CachedRun:
+    # The cache entries of one run. With the cache disabled every lookup misses and nothing is stored, so callers
+    # need no separate code path.
+    def __init__(self, image, params):
+        self.cache = get_cache(params.cache_dir) if params.result_cache else None
+        self.keys = get_keys(get_image_hash(image), image.shape[0], params) if self.cache else None
+
+    def get(self, level):
+        return self.cache.get(self.keys[level]) if self.cache else None
+
+    def put(self, level, array):
+        return self.cache.put(self.keys[level], array) if self.cache else array
+
+    def get_result(self):
+        # (sinogram, reconstruction) of a finished earlier run, or None.
+        sinogram = self.get("sinogram")
+        image_reconstructed = self.get("reconstruction") if sinogram is not None else None
+        return None if image_reconstructed is None else (sinogram, image_reconstructed)
@@ -0,0 +1,216 @@
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+import numpy as np
+import parallel
+import resultcache
+import tomograph
+from metrics import QualityMetrics
+from profiling import profiler
+
+states = ["pending", "running", "finished", "failed", "cancelled"]
+
+_job_ids = itertools.count()
+
+# Batch jobs start from a fresh interpreter rather than a fork of the GUI process with its Qt state and threads;
+# a fork server with tomograph preloaded keeps that cheap where the platform has one.
+if "forkserver" in multiprocessing.get_all_start_methods():
+    _context = multiprocessing.get_context("forkserver")
+    _context.set_forkserver_preload(["tomograph"])
+else:
+    _context = multiprocessing.get_context("spawn")
+
+
+class Job:
+    # One reconstruction. Lower priority values run first, equal priorities in submission order. An interactive job
+    # animates `plot` through a Tomograph created when it starts; a batch job runs reconstruct_image in its own process
+    # and its result holds the sinogram, the reconstruction, the MSE and the profile.
+    def __init__(self, params, priority=0, interactive=False, plot=None, name=None):
+        self.id = next(_job_ids)
+        self.params = params
+        self.priority = priority
+        self.interactive = interactive
+        self.plot = plot
+        self.name = name
+        self.state = "pending"
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.scanner = None
+        self.process = None
+        self.connection = None
+        self.cached = None
+
+
+class JobScheduler:
+    # Runs jobs in priority order: batch jobs on up to `workers` processes, interactive jobs one at a time on a thread
+    # of this process, since they share their arrays with the plot. A running batch job is cancelled by terminating
+    # its process and an interactive one stops at its next published step. All bookkeeping happens in poll(), which
+    # the owner calls from one thread (the GUI timer); workers only talk to it through pipes and a thread-safe queue,
+    # and poll() returns what changed as (job, event, payload) tuples.
+    def __init__(self, workers=None, profile=False):
+        self.workers = parallel.get_worker_count(workers)
+        self.profile = profile
+        self.jobs = []
+        self.thread_events = queue.SimpleQueue()
+        self.interactive_job = None
+
+    def submit(self, job):
+        # The image of a batch job is hashed here, once; finish_cached() looks its result up on the next dispatch.
+        if not job.interactive:
+            job.cached = resultcache.CachedRun(np.asarray(job.params.image, dtype=job.params.dtype), job.params)
+        self.jobs.append(job)
+        return job
+
+    def cancel(self, job):
+        if job.state == "pending":
+            job.state = "cancelled"
+        elif job.state == "running" and job.interactive:
+            job.scanner.cancel()
+        elif job.state == "running":
+            job.process.terminate()
+            job.process.join()
+            job.connection.close()
+            job.process = None
+            job.state = "cancelled"
+
+    def set_priority(self, job, priority):
+        job.priority = priority
+
+    def get_pending(self):
+        return sorted((job for job in self.jobs if job.state == "pending"), key=lambda job: (job.priority, job.id))
+
+    def get_running(self):
+        return [job for job in self.jobs if job.state == "running"]
+
+    def is_idle(self):
+        return not any(job.state in ("pending", "running") for job in self.jobs)
+
+    def poll(self):
+        events = [(job, "cancelled", None) for job in self.jobs if job.state == "cancelled"]
+        for job in self.get_running():
+            if not job.interactive:
+                events += self.receive(job)
+        while True:
+            try:
+                job, event, payload = self.thread_events.get_nowait()
+            except queue.Empty:
+                break
+            job.state = event
+            if event == "finished":
+                job.progress = 1.0
+            else:
+                job.error = payload
+            self.interactive_job = None
+            events.append((job, event, payload))
+        events += self.dispatch()
+        self.jobs = [job for job in self.jobs if job.state in ("pending", "running")]
+        return events
+
+    def wait(self, interval=0.05):
+        # Headless use: polls until every submitted job is done and returns all events.
+        events = self.poll()
+        while not self.is_idle():
+            time.sleep(interval)
+            events += self.poll()
+        return events
+
+    def receive(self, job):
+        events = []
+        try:
+            while job.connection.poll():
+                event, payload = job.connection.recv()
+                if event == "progress":
+                    job.progress = payload
+                else:
+                    job.state = event
+                    job.result, job.error = (payload, None) if event == "finished" else (None, payload)
+                events.append((job, event, payload))
+        except EOFError:
+            pass
+        if job.state == "running" and not job.process.is_alive():
+            job.state = "failed"
+            job.error = "worker exited with code %s" % job.process.exitcode
+            events.append((job, "failed", job.error))
+        if job.state != "running":
+            job.process.join()
+            job.connection.close()
+            job.process = None
+        return events
+
+    def dispatch(self):
+        events = []
+        batch_running = sum(1 for job in self.get_running() if not job.interactive)
+        for job in self.get_pending():
+            if job.interactive and self.interactive_job is None:
+                self.start_interactive(job)
+            elif not job.interactive and self.finish_cached(job):
+                events += [(job, "running", None), (job, "finished", job.result)]
+                continue
+            elif not job.interactive and batch_running < self.workers:
+                self.start_process(job)
+                batch_running += 1
+            else:
+                continue
+            events.append((job, "running", None))
+        return events
+
+    def start_interactive(self, job):
+        job.state = "running"
+        job.scanner = tomograph.Tomograph(job.params, job.plot, True)
+        self.interactive_job = job
+
+        def run():
+            try:
+                job.scanner.image_reconstruction(lambda: None)
+                self.thread_events.put((job, "finished", None))
+            except tomograph.ReconstructionCancelled:
+                self.thread_events.put((job, "cancelled", None))
+            except Exception as e:
+                self.thread_events.put((job, "failed", repr(e)))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def finish_cached(self, job):
+        # A batch job whose result is already in the result cache finishes at once, without a worker process. Every
+        # job is looked up only once, so later polls of a waiting job cost nothing.
+        cached, job.cached = job.cached, None
+        result = cached.get_result() if cached is not None else None
+        if result is None:
+            return False
+        job.state = "finished"
+        job.progress = 1.0
+        job.result = get_result_payload(job.params, *result)
+        return True
+
+    def start_process(self, job):
+        job.state = "running"
+        job.connection, child_connection = _context.Pipe(duplex=False)
+        job.process = _context.Process(target=run_batch_job, args=(job.params, child_connection, self.profile),
+                                        daemon=True)
+        job.process.start()
+        child_connection.close()
+
+
+def run_batch_job(params, connection, profile=False):
+    # Process entry point of a batch job; every message is an (event, payload) pair.
+    try:
+        profiler.enabled = profile
+        profiler.reset()
+        with profiler.stage("total"):
+            sinogram, image_reconstructed = tomograph.reconstruct_image(
+                params.image, params, progress=lambda fraction: connection.send(("progress", fraction)))
+        connection.send(("finished", get_result_payload(params, sinogram, image_reconstructed,
+                                                        profiler.report() if profile else None)))
+    except Exception as e:
+        connection.send(("failed", repr(e)))
+    finally:
+        connection.close()
+
+
+def get_result_payload(params, sinogram, image_reconstructed, profile=None):
+    image = np.asarray(params.image, dtype=params.dtype)
+    mse = QualityMetrics(image, mask=params.get_roi_mask(image.shape[0])).mse(image_reconstructed)
+    return {"sinogram": sinogram, "image_reconstructed": image_reconstructed, "mse": float(mse), "profile": profile}
@@ -0,0 +1,172 @@
+import json
+import os
+import tempfile
+from collections.abc import Mapping
+import numpy as np
+import tomograph
+from resultcache import get_image_hash
+from history import IterationHistory, SnapshotHistory, TransformSnapshot
+from metrics import QualityMetrics
+
+format_version = 1
+
+
+def get_parameters(params):
+    # JSON-serializable settings of a run, with the same names as the out-of-core parameters.json where they overlap.
+    roi = params.roi
+    if roi is not None and np.shape(roi) == (4,):
+        roi = [int(v) for v in roi]
+    elif roi is not None:
+        roi = "mask"
+    return {"theta": params.theta_deg, "detector_quantity": params.detector_quantity, "span": params.span_deg,
+            "filter_type": params.filter_type, "method": params.method, "iterations": params.iterations,
+            "subsets": params.subsets, "tolerance": params.tolerance, "projector": params.projector,
+            "backprojection": params.backprojection, "progressive": params.progressive,
+            "dtype": params.dtype.name, "metrics_every": params.metrics_every, "roi": roi}
+
+
+def save_session(path, params, sinogram, image_reconstructed, mse_error, history=None, sinogram_filtered=None,
+                 name=None, max_frames=None):
+    # One .npz archive per session. Every array, and every stored frame of the history, is a separately compressed
+    # member, so a reopened session only decompresses what is looked at. An angle history keeps at most max_frames
+    # of its keyframes, evenly spaced; the others are rebuilt on demand like any snapshot between keyframes. Written
+    # under a unique name and renamed, like cached system matrices, so a crash never leaves a truncated session.
+    image = np.asarray(params.image, dtype=params.dtype)
+    parameters = dict(get_parameters(params), format=format_version, size=image.shape[0], name=name,
+                      image_hash=get_image_hash(image), mse_error=float(mse_error), history=None)
+    arrays = {"image": image, "sinogram": sinogram, "image_reconstructed": image_reconstructed}
+    if sinogram_filtered is not None:
+        arrays["sinogram_filtered"] = sinogram_filtered
+    if parameters["roi"] == "mask":
+        arrays["roi"] = params.get_roi_mask(image.shape[0])
+    if isinstance(history, SnapshotHistory):
+        interval = history.keyframe_interval
+        if max_frames:
+            interval *= max(1, int(np.ceil(len(history.keyframes) / max_frames)))
+        parameters["history"] = "angles"
+        parameters["keyframe_interval"] = interval
+        arrays["sinogram_filtered"] = history.projections
+        frames = [(i, frame) for i, frame in history.keyframes.items() if i % interval == 0]
+    elif isinstance(history, IterationHistory):
+        parameters["history"] = "iterations"
+        images = history.images  # a SessionFrames mapping when the session was reopened
+        frames = images.items() if isinstance(images, Mapping) else enumerate(images)
+    else:
+        frames = []
+    for i, frame in frames:
+        arrays["frame_%d" % i] = frame
+    if history is not None:
+        arrays["mse_errors"] = history.mse_errors
+    arrays["parameters"] = np.array(json.dumps(parameters))
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=".tmp.npz", delete=False) as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(f.name, path)
+    # Temporary files are created private; give the session the permissions of any other new file.
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(path, 0o666 & ~umask)
+
+
+def save_tomograph(path, scanner, name=None, max_frames=None):
+    result = scanner.result
+    return save_session(path, scanner.params, result.sinogram, result.image_reconstructed, result.mse_error,
+                        scanner.history, name=name, max_frames=max_frames)
+
+
+class SessionFrames(Mapping):
+    # History frames read from the archive on first access; works as both the keyframe dict of SnapshotHistory and
+    # the image list of IterationHistory.
+    def __init__(self, archive):
+        self.archive = archive
+        self.indexes = sorted(int(name[len("frame_"):]) for name in archive.files if name.startswith("frame_"))
+
+    def __getitem__(self, i):
+        return self.archive["frame_%d" % i]
+
+    def __iter__(self):
+        return iter(self.indexes)
+
+    def __len__(self):
+        return len(self.indexes)
+
+
+class LazyBackprojector:
+    # Snapshots between keyframes are rebuilt by backprojecting angles again; the backprojector is only obtained
+    # (from the matrix cache, or traced) the first time that happens.
+    def __init__(self, params, size):
+        self.params = params
+        self.size = size
+        self.backprojector = None
+
+    def backproject_angle(self, sinogram_projection, i, image):
+        if self.backprojector is None:
+            self.backprojector = self.params.get_backprojector(self.size)
+        return self.backprojector.backproject_angle(sinogram_projection, i, image)
+
+
+class Session:
+    def __init__(self, path, cache_dir=None):
+        self.path = path
+        self.archive = np.load(path)
+        self.parameters = json.loads(str(self.archive["parameters"]))
+        if self.parameters["format"] > format_version:
+            raise ValueError("Session %s needs a newer version (format %d)" % (path, self.parameters["format"]))
+        self.cache_dir = cache_dir
+
+    def __getitem__(self, name):
+        return self.archive[name]
+
+    def __contains__(self, name):
+        return name in self.archive.files
+
+    def close(self):
+        self.archive.close()
+
+    def get_params(self):
+        p = self.parameters
+        roi = self.archive["roi"] if p["roi"] == "mask" else p["roi"]
+        return tomograph.TomographParameters(self.archive["image"], p["theta"], p["detector_quantity"], p["span"],
+                                             p["filter_type"], cache_dir=self.cache_dir, method=p["method"],
+                                             iterations=p["iterations"], subsets=p["subsets"],
+                                             tolerance=p["tolerance"], metrics_every=p["metrics_every"],
+                                             projector=p["projector"], backprojection=p["backprojection"],
+                                             progressive=p["progressive"], dtype=p["dtype"], roi=roi)
+
+    def get_history(self, params):
+        kind = self.parameters["history"]
+        if kind is None:
+            return None
+        if kind == "iterations":
+            history = IterationHistory(0)
+            history.sinogram = self.archive["sinogram"]
+            history.images = SessionFrames(self.archive)
+        else:
+            size = self.parameters["size"]
+            history = SnapshotHistory(len(params.emitter_angles), size, LazyBackprojector(params, size),
+                                      keyframe_interval=self.parameters["keyframe_interval"], dtype=params.dtype)
+            history.sinogram = self.archive["sinogram"]
+            history.projections = self.archive["sinogram_filtered"]
+            history.keyframes = SessionFrames(self.archive)
+        history.mse_errors = self.archive["mse_errors"]
+        return history
+
+    def open_tomograph(self, plot=None):
+        # A finished interactive Tomograph as if the run had just ended: get_snapshot() scrubs the stored history and
+        # the final state is queued for drawing. Nothing is reconstructed.
+        params = self.get_params()
+        scanner = tomograph.Tomograph(params, plot, True)
+        scanner.image = np.asarray(params.image)
+        scanner.metrics = QualityMetrics(scanner.image, params.metrics_every,
+                                         mask=params.get_roi_mask(len(scanner.image)))
+        scanner.history = self.get_history(params)
+        scanner.sinogram = self.archive["sinogram"]
+        scanner.image_reconstructed = self.archive["image_reconstructed"]
+        scanner.mse_error = self.parameters["mse_error"]
+        scanner.result = TransformSnapshot(scanner.sinogram, scanner.image_reconstructed, scanner.mse_error)
+        if scanner.history is not None:
+            scanner.mse_steps = list(np.flatnonzero(~np.isnan(scanner.history.mse_errors)))
+            scanner.mse_data = list(scanner.history.mse_errors[scanner.mse_steps])
+        scanner.progress.put(("sinogram", None))
+        scanner.progress.put(("image", None))
+        return scanner
@@ -0,0 +1,105 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import backends
+import ingest
+import tomograph
+from metrics import QualityMetrics
+
+fields = ["file", "theta", "detectors", "span", "filter", "method", "projector", "backprojection", "dtype", "backend",
+          "mse", "wall_time", "peak_memory"]
+
+
+def run_single(image_path, theta, detectors, span, filter_type, method, projector, backprojection, dtype, cache_dir,
+               resolution=None, mode="pad", backend="auto", roi=None):
+    backend = backends.use(backend).name
+    tracemalloc.start()
+    start = time.perf_counter()
+    image = ingest.load_image(image_path, resolution, mode, dtype=dtype)
+    params = tomograph.TomographParameters(image, theta, detectors, span, filter_type, cache_dir=cache_dir,
+                                           method=method, projector=projector, backprojection=backprojection,
+                                           dtype=dtype, roi=roi)
+    _, image_reconstructed = tomograph.reconstruct_image(image, params)
+    mse = QualityMetrics(image, mask=params.get_roi_mask(image.shape[0])).mse(image_reconstructed)
+    wall_time = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"file": os.path.basename(image_path), "theta": theta, "detectors": detectors, "span": span,
+            "filter": filter_type, "method": method, "projector": projector,
+            "backprojection": backprojection, "dtype": dtype, "backend": backend, "mse": float(mse),
+            "wall_time": wall_time, "peak_memory": peak_memory}
+
+
+class RowWriter:
+    # Writes one row per finished run and flushes, so partial results survive an interrupted sweep.
+    def __init__(self, stream, output_format):
+        self.stream = stream
+        self.output_format = output_format
+        self.csv_writer = None
+        if output_format == "csv":
+            self.csv_writer = csv.DictWriter(stream, fieldnames=fields)
+            self.csv_writer.writeheader()
+
+    def write(self, row):
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(row)
+        else:
+            self.stream.write(json.dumps(row) + "\n")
+        self.stream.flush()
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Run reconstruction parameter sweeps without the GUI.")
+    parser.add_argument("images", nargs="*", help="images to reconstruct (default: all files in examples/)")
+    parser.add_argument("--theta", type=float, nargs="+", default=[1.0], help="emitter angle steps [deg]")
+    parser.add_argument("--detectors", type=int, nargs="+", default=[100], help="detector counts")
+    parser.add_argument("--span", type=float, nargs="+", default=[180.0], help="detector spans [deg]")
+    parser.add_argument("--filter", nargs="+", default=["ramp"], dest="filters", help="filter types")
+    parser.add_argument("--method", nargs="+", default=["FBP"], dest="methods", help="reconstruction methods")
+    parser.add_argument("--projector", nargs="+", default=["bresenham"], dest="projectors",
+                        choices=["bresenham", "joseph"], help="ray projectors")
+    parser.add_argument("--backprojection", nargs="+", default=["ray"], dest="backprojections",
+                        choices=["ray", "pixel"], help="backprojection modes")
+    parser.add_argument("--dtype", nargs="+", default=["float64"], dest="dtypes", choices=["float64", "float32"],
+                        help="floating point precisions")
+    parser.add_argument("--resolution", type=int, help="rescale images to this size in pixels before reconstruction")
+    parser.add_argument("--mode", default="pad", choices=ingest.modes,
+                        help="pad images to their diagonal or keep only the inscribed circle")
+    parser.add_argument("--backend", default="auto", choices=backends.get_choices(),
+                        help="kernel backend; numba falls back to numpy when it is not installed")
+    parser.add_argument("--roi", type=int, nargs=4, metavar=("TOP", "LEFT", "BOTTOM", "RIGHT"),
+                        help="only backproject and score this pixel rectangle of the squared image")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="parallel runs")
+    parser.add_argument("--output", default="-", help="output file, .csv or .json (JSON lines); - for stdout")
+    parser.add_argument("--format", choices=["csv", "json"], help="output format (default: from --output)")
+    parser.add_argument("--cache-dir", default=".cache", help="system matrix cache directory")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    images = args.images or sorted(os.path.join("examples", name) for name in os.listdir("examples"))
+    output_format = args.format or ("json" if args.output.endswith(".json") else "csv")
+    runs = itertools.product(images, args.theta, args.detectors, args.span, args.filters, args.methods,
+                             args.projectors, args.backprojections, args.dtypes)
+    stream = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+    try:
+        writer = RowWriter(stream, output_format)
+        with ProcessPoolExecutor(max(1, args.jobs)) as executor:
+            futures = [executor.submit(run_single, *run, args.cache_dir, args.resolution, args.mode,
+                                       args.backend, args.roi) for run in runs]
+            for future in as_completed(futures):
+                writer.write(future.result())
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+
+
+if __name__ == '__main__':
+    main()
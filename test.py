@@ -2,6 +2,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import tomograph
 import filter
+import ingest
 from skimage.io import imread
 from skimage.transform import rescale
 
@@ -14,20 +15,10 @@ class Params:
         self.span = np.deg2rad(span)
 
 
-def make_image_square(image_original):
-    diagonal = np.sqrt(2) * max(image_original.shape)
-    pad = [int(np.ceil(diagonal - s)) for s in image_original.shape]
-    new_center = [(s + p) // 2 for s, p in zip(image_original.shape, pad)]
-    old_center = [s // 2 for s in image_original.shape]
-    pad_before = [nc - oc for oc, nc in zip(old_center, new_center)]
-    pad_width = [(pb, p - pb) for pb, p in zip(pad_before, pad)]
-    return np.pad(image_original, pad_width, mode='constant', constant_values=0)
-
-
 params = Params("examples/Kwadraty2.jpg", 4, 100, 180)
 image_original = imread(params.image_path, as_gray=True)
 image_rescaled = rescale(image_original, scale=0.4)
-image_padded = make_image_square(image_rescaled)
+image_padded = ingest.make_image_square(image_rescaled)
 emitter_angles = tomograph.generate_angles(params.theta)
 sinogram = tomograph.radon(image_padded, emitter_angles, params.detector_quantity, params.span)
 sinogram_filtered = filter.filter_sinogram(sinogram, "ramp")
@@ -0,0 +1,150 @@
+import numpy as np
+import pytest
+import backends
+import bresenham
+import projection
+from projection import Point
+
+size = 41
+emitter_angles = np.deg2rad(np.arange(0, 360, 15))
+detector_quantity = 17
+
+
+@pytest.fixture(params=backends.get_choices())
+def backend(request):
+    if request.param == "numba" and backends.numba is None:
+        pytest.skip("Numba is not installed")
+    previous = backends.active
+    yield backends.use(request.param)
+    backends.active = previous
+
+
+@pytest.fixture
+def image():
+    return np.random.default_rng(0).random((size, size))
+
+
+def get_detectors(emitter_angle, layout, span):
+    # Scanner geometry of the per-ray loops the system matrix replaced.
+    center, base = projection.get_scanner_circle(size, layout)
+    detector_step = span / detector_quantity
+    detectors_angles = [emitter_angle + np.pi - span / 2.0 + k * detector_step for k in range(detector_quantity)]
+    return base.get_coords(center, emitter_angle), [base.get_coords(center, angle) for angle in detectors_angles]
+
+
+def baseline_radon(image, span):
+    sinogram = np.zeros((len(emitter_angles), detector_quantity))
+    for i, emitter_angle in enumerate(emitter_angles):
+        source, detectors = get_detectors(emitter_angle, "radon", span)
+        for j, detector in enumerate(detectors):
+            path = bresenham.bresenham_indexes(source, detector)
+            sinogram[i, j] = image[path[:, 0], path[:, 1]].sum()
+    return sinogram
+
+
+def baseline_inverse_radon(sinogram, span):
+    image = np.zeros((size, size))
+    for projection_row, emitter_angle in zip(sinogram, emitter_angles):
+        source, detectors = get_detectors(emitter_angle, "inverse_radon", span)
+        for value, detector in zip(projection_row, detectors):
+            path = bresenham.bresenham_indexes(source, detector)
+            image[path[:, 0], path[:, 1]] += value
+    return image
+
+
+def test_bresenham_batch_matches_bresenham_indexes(backend):
+    rng = np.random.default_rng(1)
+    x0, y0, x1, y1 = rng.integers(-20, 60, size=(4, 500))
+    x1[:10], y1[:10] = x0[:10], y0[:10]  # single-pixel rays
+    x1[10:20] = x0[10:20]  # vertical and horizontal rays
+    y1[20:30] = y0[20:30]
+    paths, offsets = backend.bresenham_batch(x0, y0, x1, y1)
+    for r in range(len(x0)):
+        expected = bresenham.bresenham_indexes(Point(x0[r], y0[r]), Point(x1[r], y1[r]))
+        np.testing.assert_array_equal(paths[offsets[r]:offsets[r + 1]], expected)
+
+
+def test_bresenham_batch_step_ranges(backend):
+    rng = np.random.default_rng(2)
+    x0, y0, x1, y1 = rng.integers(-20, 60, size=(4, 200))
+    full, full_offsets = backend.bresenham_batch(x0, y0, x1, y1)
+    lengths = np.diff(full_offsets)
+    start = rng.integers(0, lengths + 1)
+    stop = start + rng.integers(0, lengths - start + 1)
+    paths, offsets = backend.bresenham_batch(x0, y0, x1, y1, start, stop)
+    for r in range(len(x0)):
+        np.testing.assert_array_equal(paths[offsets[r]:offsets[r + 1]],
+                                      full[full_offsets[r] + start[r]:full_offsets[r] + stop[r]])
+
+
+@pytest.mark.parametrize("span", [np.pi, np.deg2rad(120)])
+def test_system_matrix_traces_the_same_pixels(backend, span):
+    system_matrix = projection.SystemMatrix(size, emitter_angles, detector_quantity, span, "radon")
+    matrix = system_matrix.matrix
+    for i, emitter_angle in enumerate(emitter_angles):
+        source, detectors = get_detectors(emitter_angle, "radon", span)
+        for j, detector in enumerate(detectors):
+            row = i * detector_quantity + j
+            path = bresenham.bresenham_indexes(source, detector)
+            np.testing.assert_array_equal(matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]],
+                                          path[:, 0] * size + path[:, 1])
+
+
+@pytest.mark.parametrize("span", [np.pi, np.deg2rad(120)])
+def test_projection_matches_baseline(backend, image, span):
+    forward_matrix = projection.SystemMatrix(size, emitter_angles, detector_quantity, span, "radon")
+    backward_matrix = projection.SystemMatrix(size, emitter_angles, detector_quantity, span, "inverse_radon")
+    sinogram = forward_matrix.project(image)
+    np.testing.assert_allclose(sinogram, baseline_radon(image, span), rtol=1e-12)
+    np.testing.assert_allclose(backward_matrix.backproject(sinogram), baseline_inverse_radon(sinogram, span),
+                               rtol=1e-12)
+
+
+@pytest.mark.parametrize("columns", [None, 3])
+def test_kernels_match_reference_backend(backend, columns):
+    system_matrix = projection.SystemMatrix(size, emitter_angles, detector_quantity, np.pi, "radon")
+    block = projection.row_block(system_matrix.matrix, 5 * detector_quantity, 11 * detector_quantity)
+    rng = np.random.default_rng(3)
+    shape = () if columns is None else (columns,)
+    x = rng.random((block.shape[1],) + shape)
+    y = rng.random((block.shape[0],) + shape)
+    reference = backends.NumpyBackend()
+    np.testing.assert_array_equal(backend.gather_sum(block, x), reference.gather_sum(block, x))
+    np.testing.assert_array_equal(backend.scatter_add(block, y), reference.scatter_add(block, y))
+    np.testing.assert_allclose(reference.gather_sum(block, x), block.toarray() @ x, rtol=1e-12)
+    np.testing.assert_allclose(reference.scatter_add(block, y), block.toarray().T @ y, rtol=1e-12)
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_parallel_matches_serial(backend, image, dtype):
+    operators = [projection.SystemMatrix(size, emitter_angles, detector_quantity, np.pi, "inverse_radon",
+                                         dtype=dtype),
+                 projection.ChunkedSystemMatrix(size, emitter_angles, detector_quantity, np.pi, "inverse_radon",
+                                                dtype=dtype, chunk_budget=1),
+                 projection.PixelBackprojector(size, emitter_angles, detector_quantity, np.pi, dtype=dtype)]
+    sinogram = np.random.default_rng(4).random((2, len(emitter_angles), detector_quantity)).astype(dtype)
+    for operator in operators:
+        serial = operator.backproject(sinogram[0], workers=1)
+        for workers in (2, 3, 7):
+            np.testing.assert_array_equal(operator.backproject(sinogram[0], workers=workers), serial)
+        np.testing.assert_array_equal(operator.backproject(sinogram, workers=3)[0], serial)
+        if not isinstance(operator, projection.PixelBackprojector):
+            serial = operator.project(image, workers=1)
+            for workers in (2, 3, 7):
+                np.testing.assert_array_equal(operator.project(image, workers=workers), serial)
+
+
+def test_chunked_matrix_cache(tmp_path, image):
+    whole = projection.SystemMatrix(size, emitter_angles, detector_quantity, np.pi, "radon")
+    expected = whole.project(image)
+    traced = projection.ChunkedSystemMatrix(size, emitter_angles, detector_quantity, np.pi, chunk_budget=1,
+                                            cache_dir=tmp_path)
+    np.testing.assert_array_equal(traced.project(image), expected)
+    loaded = projection.ChunkedSystemMatrix(size, emitter_angles, detector_quantity, np.pi, chunk_budget=1,
+                                            cache_dir=tmp_path)
+    assert isinstance(loaded.get_chunk(0).matrix.data, np.memmap)
+    np.testing.assert_array_equal(loaded.project(image), expected)
+    chunk_nbytes = sum(f.stat().st_size for f in tmp_path.glob("*-0-1.*.npy"))
+    projection.evict_matrix_files(tmp_path, disk_budget=2 * chunk_nbytes)
+    remaining = sorted(f.name.split(".")[0] for f in tmp_path.iterdir())
+    assert len(remaining) == 6 and len(set(remaining)) == 2  # whole chunks, all three arrays of each
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+import ingest
+import session
+import tomograph
+
+runs = [{}, {"filter_type": "Fourier"}, {"method": "SART", "iterations": 3}, {"progressive": True},
+        {"roi": (10, 12, 30, 34)}]
+
+
+def reconstruct(filter_type="Ramp", **options):
+    image = ingest.load_image("examples/sl100.jpg", resolution=48)
+    params = tomograph.TomographParameters(image, 10, 40, 180, filter_type, history_budget=None, **options)
+    scanner = tomograph.Tomograph(params, None, True)
+    scanner.image_reconstruction(lambda: None)
+    return scanner
+
+
+def get_snapshots(scanner):
+    snapshots = []
+    for i in (0, 10, 50, 99):
+        scanner.get_snapshot(i)
+        snapshots.append((np.array(scanner.sinogram), np.array(scanner.image_reconstructed), scanner.mse_error))
+    return snapshots
+
+
+def assert_same_snapshots(snapshots, expected):
+    for (sinogram, image, mse_error), (expected_sinogram, expected_image, expected_mse_error) in zip(snapshots,
+                                                                                                   expected):
+        np.testing.assert_array_equal(sinogram, expected_sinogram)
+        np.testing.assert_allclose(image, expected_image, rtol=1e-12, atol=1e-12)
+        assert mse_error == pytest.approx(expected_mse_error, rel=1e-12)
+
+
+@pytest.mark.parametrize("options", runs)
+def test_save_after_scrubbing_keeps_final_result(tmp_path, options):
+    scanner = reconstruct(**options)
+    sinogram, image_reconstructed, mse_error = scanner.sinogram, scanner.image_reconstructed, scanner.mse_error
+    scanner.get_snapshot(10)
+    session.save_tomograph(tmp_path / "run.npz", scanner)
+    opened = session.Session(tmp_path / "run.npz")
+    np.testing.assert_array_equal(opened["sinogram"], sinogram)
+    np.testing.assert_array_equal(opened["image_reconstructed"], image_reconstructed)
+    assert opened.parameters["mse_error"] == mse_error
+    opened.close()
+
+
+@pytest.mark.parametrize("options", runs)
+def test_round_trip(tmp_path, options):
+    scanner = reconstruct(**options)
+    expected = get_snapshots(scanner)
+    session.save_tomograph(tmp_path / "first.npz", scanner)
+    first = session.Session(tmp_path / "first.npz")
+    reopened = first.open_tomograph()
+    assert_same_snapshots(get_snapshots(reopened), expected)
+    session.save_tomograph(tmp_path / "second.npz", reopened)
+    second = session.Session(tmp_path / "second.npz")
+    reopened_twice = second.open_tomograph()
+    np.testing.assert_array_equal(reopened_twice.result.image_reconstructed, scanner.result.image_reconstructed)
+    assert_same_snapshots(get_snapshots(reopened_twice), expected)
+    first.close()
+    second.close()
@@ -1,21 +1,51 @@
+import queue
 import numpy as np
-import bresenham
+from skimage.transform import resize
 import filter
-from math import sin, cos
+import fourier
+import iterative
+import outofcore
+import projection
+import resultcache
+from history import IterationHistory, SnapshotHistory, TransformSnapshot
+from metrics import QualityMetrics
+from profiling import profiler
+
+progressive_stages = [(0.25, 4), (0.5, 2), (1, 2), (1, 1)]
 
 
 class TomographParameters:
-    def __init__(self, image, theta, detector_quantity, span, filter_type):
-        self.image = image
-        self.theta = np.deg2rad(float(theta))
-        self.detector_quantity = int(detector_quantity)
-        self.span = np.deg2rad(span)
-        self.filter_type = filter_type
-        self.emitter_angles = generate_angles(self.theta)
-        self.theta_deg = theta
-        self.span_deg = span
+    def __init__(self, image, theta, detector_quantity, span, filter_type, cache_dir=None, workers=1,
+                 history_budget=256 * 2 ** 20, method="FBP", iterations=10, subsets=10, tolerance=None,
+                 buffer_dir=None, memory_budget=256 * 2 ** 20, metrics_every=1, metrics_interval=None,
+                 projector="bresenham", backprojection="ray", progressive=False, dtype=float, roi=None,
+                 result_cache=False):
+        self.set_parameters(image, theta, detector_quantity, span, filter_type, cache_dir, workers, history_budget,
+                            method, iterations, subsets, tolerance, buffer_dir, memory_budget, metrics_every,
+                            metrics_interval, projector, backprojection, progressive, dtype, roi, result_cache)
+
+    def get_system_matrix(self, size, layout, whole=False):
+        return projection.get_system_matrix(size, self.emitter_angles, self.detector_quantity, self.span, layout,
+                                            cache_dir=self.cache_dir, projector=self.projector, dtype=self.dtype,
+                                            whole=whole)
 
-    def set_parameters(self, image, theta, detector_quantity, span, filter_type):
+    def get_backprojector(self, size):
+        return projection.get_backprojector(size, self.emitter_angles, self.detector_quantity, self.span,
+                                            self.backprojection, cache_dir=self.cache_dir, projector=self.projector,
+                                            dtype=self.dtype, roi=self.roi)
+
+    def get_roi_mask(self, size):
+        return projection.get_roi_mask(size, self.roi)
+
+    def set_parameters(self, image, theta, detector_quantity, span, filter_type, cache_dir=None, workers=1,
+                       history_budget=256 * 2 ** 20, method="FBP", iterations=10, subsets=10, tolerance=None,
+                       buffer_dir=None, memory_budget=256 * 2 ** 20, metrics_every=1, metrics_interval=None,
+                       projector="bresenham", backprojection="ray", progressive=False, dtype=float, roi=None,
+                       result_cache=False):
+        # `roi` limits filtered backprojection and the quality metrics to a region of the image (see
+        # projection.get_roi_mask); iterative and Fourier reconstructions still cover the whole image.
+        # `result_cache` reuses sinograms, filtered sinograms and reconstructions of earlier runs on the same image
+        # content (see resultcache); off by default, so timings measure actual work.
         self.image = image
         self.theta = np.deg2rad(float(theta))
         self.detector_quantity = int(detector_quantity)
@@ -24,91 +54,323 @@ class TomographParameters:
         self.emitter_angles = generate_angles(self.theta)
         self.theta_deg = theta
         self.span_deg = span
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.history_budget = history_budget
+        self.method = method
+        self.iterations = int(iterations)
+        self.subsets = int(subsets)
+        self.tolerance = tolerance
+        self.buffer_dir = buffer_dir
+        self.memory_budget = memory_budget
+        self.metrics_every = metrics_every
+        self.metrics_interval = metrics_interval
+        self.projector = projector
+        self.backprojection = backprojection
+        self.progressive = progressive
+        self.dtype = np.dtype(dtype)
+        self.roi = roi
+        self.result_cache = result_cache
 
 
-class Point:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-
-    def get_coords(self, center, angle):
-        s = sin(angle)
-        c = cos(angle)
-        x = self.x - center.x
-        y = self.y - center.y
-        nx = x * c - y * s
-        ny = x * s + y * c
-        x = nx + center.x
-        y = ny + center.y
-        return Point(round(x), round(y))
-
-
-class TransformSnapshot:
-    def __init__(self, sinogram=None, image_reconstructed=None, square_error=None) -> None:
-        self.sinogram = sinogram
-        self.image_reconstructed = image_reconstructed
-        self.mse_error = square_error
+class ReconstructionCancelled(Exception):
+    pass
 
 
 class Tomograph:
+    # An interactive run publishes ("sinogram" | "image", step) on `progress` whenever the corresponding array
+    # changed; the arrays themselves are read from the Tomograph when the events are consumed. cancel() stops a run
+    # at its next published step. sinogram, image_reconstructed and mse_error are the shown state, which
+    # get_snapshot() changes; `result` keeps the final state of the finished run.
     def __init__(self, params, plot, is_interactive) -> None:
         self.params = params
         self.plot = plot
         self.is_interactive = is_interactive
+        self.image = None
         self.sinogram = None
         self.image_reconstructed = None
         self.mse_error = 0
-        self.refresh_sinogram = self.refresh_image_reconstructed = False
-        self.snapshots = [TransformSnapshot() for _ in self.params.emitter_angles]
+        self.progress = queue.SimpleQueue()
+        self.cancelled = False
+        self.history = None
         self.mse_data = []
+        self.mse_steps = []
+        self.metrics = None
+        self.profile = None
+        self.cached = None
+        self.cached_result = False
+        self.result = None
+
+    def get_steps_count(self):
+        if self.cached_result:
+            return 1
+        if self.params.method in iterative.methods:
+            return self.params.iterations
+        if self.is_progressive():
+            return len(get_progressive_stages(np.shape(self.params.image)[0]))
+        if self.params.filter_type in fourier.methods:
+            return 1
+        return len(self.params.emitter_angles)
+
+    def is_progressive(self):
+        # Progressive previews replace the angle-by-angle animation, so they only apply to interactive FBP runs.
+        return self.params.progressive and self.is_interactive and self.params.method not in iterative.methods
 
     def get_snapshot(self, i):
-        i = int(i / 99 * (len(self.params.emitter_angles) - 1))  # slider takes values 0-99
-        snap = self.snapshots[i]
+        i = int(i / 99 * (len(self.history) - 1))  # slider takes values 0-99
+        snap = self.history.get_snapshot(i)
         self.image_reconstructed = snap.image_reconstructed
         self.sinogram = snap.sinogram
-        self.refresh_sinogram = True
         self.mse_error = snap.mse_error
-        self.mse_data = [s.mse_error for s in self.snapshots[:i]]
-        self.refresh_image_reconstructed = True
+        if np.isnan(self.mse_error):  # skipped by the metric cadence during the run
+            self.mse_error = self.metrics.mse(snap.image_reconstructed)
+        self.mse_steps = list(np.flatnonzero(~np.isnan(self.history.mse_errors[:i])))
+        self.mse_data = list(self.history.mse_errors[self.mse_steps])
+        self.progress.put(("sinogram", i))
+        self.progress.put(("image", i))
+
+    def cancel(self):
+        self.cancelled = True
 
     def history_builder(self, sinogram=None, image_reconstructed=None, iteration=None):
+        if self.cancelled:
+            raise ReconstructionCancelled()
         if sinogram is not None:
-            if self.sinogram is None:
-                self.sinogram = sinogram
-                self.plot.put_sinogram_in_animation_buf(sinogram)
-            else:
-                self.sinogram = sinogram
-            self.snapshots[iteration].sinogram = np.array(sinogram)
-            self.refresh_sinogram = True
+            self.sinogram = sinogram
+            self.history.add_sinogram(sinogram)
+            self.progress.put(("sinogram", iteration))
         if image_reconstructed is not None:
-            if self.image_reconstructed is None:
-                self.image_reconstructed = image_reconstructed
-                self.plot.put_image_reconstructed_in_animation_buf(image_reconstructed)
-            else:
-                self.image_reconstructed = image_reconstructed
-            self.mse_error = get_mean_squared_error(self.plot.image, image_reconstructed)
-            self.snapshots[iteration].image_reconstructed = np.array(image_reconstructed)
-            self.snapshots[iteration].mse_error = self.mse_error
-            self.mse_data.append(self.snapshots[iteration].mse_error)
-            self.refresh_image_reconstructed = True
+            self.image_reconstructed = image_reconstructed
+            mse_error = np.nan
+            if self.metrics.should_evaluate(iteration, iteration == self.get_steps_count() - 1):
+                with profiler.stage("metrics"):
+                    self.mse_error = mse_error = self.metrics.mse(image_reconstructed)
+                self.mse_steps.append(iteration)
+                self.mse_data.append(mse_error)
+            with profiler.stage("snapshots"):
+                self.history.add_image(iteration, image_reconstructed, mse_error)
+            self.progress.put(("image", iteration))
 
     def image_reconstruction(self, on_finish_task):
-        self.sinogram = radon(self.plot.image, self.params.emitter_angles, self.params.detector_quantity,
-                              self.params.span, self.is_interactive, history_builder=self.history_builder)
-        if self.params.filter_type != "None":
-            sinogram_filtered = filter.filter_sinogram(self.sinogram, self.params.filter_type)
-            self.image_reconstructed = inverse_radon(sinogram_filtered, self.plot.image.shape[0],
-                                                     self.params.emitter_angles, self.params.detector_quantity,
-                                                     self.params.span, self.is_interactive, history_builder=self.history_builder)
-        else:
-            self.image_reconstructed = inverse_radon(self.sinogram, self.plot.image.shape[0],
-                                                     self.params.emitter_angles, self.params.detector_quantity,
-                                                     self.params.span, self.is_interactive, history_builder=self.history_builder)
-        if not self.is_interactive:
-            self.mse_error = get_mean_squared_error(self.plot.image, self.image_reconstructed)
+        profiler.reset()
+        self.image = np.asarray(self.params.image, dtype=self.params.dtype)
+        self.metrics = QualityMetrics(self.image, self.params.metrics_every, self.params.metrics_interval,
+                                      self.params.get_roi_mask(self.image.shape[0]))
+        self.cached = resultcache.CachedRun(self.image, self.params)
+        with profiler.stage("total"):
+            if self.load_cached_result():
+                pass
+            elif self.is_progressive():
+                self.progressive_reconstruction()
+            elif self.params.method in iterative.methods:
+                self.iterative_reconstruction()
+            elif self.params.filter_type in fourier.methods:
+                self.fourier_reconstruction()
+            else:
+                self.backprojection_reconstruction()
+            if not self.is_interactive:
+                with profiler.stage("metrics"):
+                    self.mse_error = self.metrics.mse(self.image_reconstructed)
+        self.result = TransformSnapshot(self.sinogram, self.image_reconstructed, self.mse_error)
+        self.profile = profiler.report() if profiler.enabled else None
         on_finish_task()
 
+    def load_cached_result(self):
+        # A run whose sinogram and reconstruction are both cached is published as one finished snapshot, like a
+        # Fourier reconstruction.
+        result = self.cached.get_result()
+        if result is None:
+            return False
+        sinogram, image_reconstructed = result
+        self.cached_result = True
+        self.history = IterationHistory(1)
+        if self.is_interactive:
+            self.history_builder(sinogram=sinogram, image_reconstructed=image_reconstructed, iteration=0)
+        self.sinogram = sinogram
+        self.image_reconstructed = image_reconstructed
+        profiler.count("cached_results")
+        return True
+
+    def project_sinogram(self, system_matrix=None):
+        # A cached sinogram is published at once instead of being animated angle by angle.
+        sinogram = self.cached.get("sinogram")
+        if sinogram is not None:
+            if self.is_interactive:
+                self.history_builder(sinogram=sinogram, iteration=len(self.params.emitter_angles) - 1)
+            return sinogram
+        if system_matrix is None:
+            system_matrix = self.params.get_system_matrix(self.image.shape[0], "radon")
+        return self.cached.put("sinogram", radon(self.image, self.params.emitter_angles,
+                                                 self.params.detector_quantity, self.params.span, self.is_interactive,
+                                                 history_builder=self.history_builder, system_matrix=system_matrix,
+                                                 workers=self.params.workers))
+
+    def backprojection_reconstruction(self):
+        size = self.image.shape[0]
+        if self.params.buffer_dir and not self.is_interactive:
+            self.sinogram, _, self.image_reconstructed = outofcore.reconstruct_out_of_core(
+                self.image, self.params, self.params.buffer_dir, self.params.memory_budget)
+            return
+        backward_matrix = self.params.get_backprojector(size)
+        self.history = SnapshotHistory(len(self.params.emitter_angles), size, backward_matrix,
+                                       memory_budget=self.params.history_budget, dtype=self.params.dtype)
+        self.sinogram = self.project_sinogram()
+        with profiler.stage("filtering"):
+            sinogram_filtered = filter_sinogram(self.sinogram, self.params.filter_type, self.cached)
+        self.history.projections = sinogram_filtered
+        self.image_reconstructed = self.cached.put("reconstruction", inverse_radon(
+            sinogram_filtered, size, self.params.emitter_angles, self.params.detector_quantity, self.params.span,
+            self.is_interactive, history_builder=self.history_builder, system_matrix=backward_matrix,
+            workers=self.params.workers))
+
+    def fourier_reconstruction(self):
+        # Direct Fourier inversion has no per-angle partial images, so the history holds the final reconstruction only.
+        size = self.image.shape[0]
+        self.history = IterationHistory(1)
+        self.sinogram = self.project_sinogram()
+        with profiler.stage("fourier"):
+            image_reconstructed = self.cached.put("reconstruction", fourier.reconstruct(
+                self.sinogram, size, self.params.emitter_angles, self.params.detector_quantity, self.params.span,
+                self.params.workers))
+        if self.is_interactive:
+            self.history_builder(image_reconstructed=image_reconstructed, iteration=0)
+        self.image_reconstructed = image_reconstructed
+
+    def progressive_reconstruction(self):
+        # Coarse-to-fine preview: each stage is published as one snapshot. Downscaled stages are independent, cheap
+        # reconstructions; the full-resolution stages share one geometry, so every stage only projects, filters and
+        # backprojects the angles the previous ones skipped and adds them to the same sinogram and image.
+        size = self.image.shape[0]
+        stages = get_progressive_stages(size)
+        self.history = IterationHistory(len(stages))
+        angles_count = len(self.params.emitter_angles)
+        sinogram = np.zeros((angles_count, self.params.detector_quantity), dtype=self.params.dtype)
+        image = np.zeros((size, size), dtype=self.params.dtype)
+        done = np.zeros(angles_count, dtype=bool)
+        forward_matrix = backward_matrix = None
+        for stage, (scale, step) in enumerate(stages):
+            with profiler.stage("progressive"):
+                if scale < 1:
+                    preview_sinogram, preview = reconstruct_preview(self.image, self.params, scale, step)
+                    self.history_builder(sinogram=preview_sinogram, image_reconstructed=preview, iteration=stage)
+                    continue
+                if forward_matrix is None:
+                    forward_matrix = self.params.get_system_matrix(size, "radon")
+                    backward_matrix = self.params.get_backprojector(size)
+                indexes = np.flatnonzero(~done[::step]) * step
+                done[indexes] = True
+                for i in indexes:
+                    sinogram[i] = forward_matrix.project_angle(self.image, i)
+                if self.params.filter_type in fourier.methods:
+                    image = fourier.reconstruct(sinogram[::step], size, np.asarray(self.params.emitter_angles)[::step],
+                                                self.params.detector_quantity, self.params.span, self.params.workers)
+                else:
+                    sinogram_filtered = sinogram[indexes]
+                    if self.params.filter_type != "None":
+                        sinogram_filtered = filter.filter_sinogram(sinogram_filtered, self.params.filter_type)
+                    for i, sinogram_projection in zip(indexes, sinogram_filtered):
+                        backward_matrix.backproject_angle(sinogram_projection, i, image)
+                self.history_builder(sinogram=np.array(sinogram), image_reconstructed=np.array(image),
+                                     iteration=stage)
+        self.sinogram = sinogram
+        self.image_reconstructed = image
+
+    def iterative_reconstruction(self):
+        # Iterative methods need a matched projector/backprojector pair, so both directions use the radon layout.
+        size = self.image.shape[0]
+        system_matrix = self.params.get_system_matrix(size, "radon", whole=True)
+        self.history = IterationHistory(self.params.iterations)
+        self.sinogram = self.project_sinogram(system_matrix)
+        callback = None
+        if self.is_interactive:
+            def callback(iteration, image, _):
+                self.history_builder(image_reconstructed=image, iteration=iteration)
+        with profiler.stage("iterative"):
+            self.image_reconstructed = self.cached.put("reconstruction", iterative.reconstruct(
+                self.sinogram, system_matrix, self.params.method, self.params.iterations, self.params.subsets,
+                original=self.image, tolerance=self.params.tolerance, callback=callback))
+
+
+def reconstruct_image(image, params, progress=None):
+    # Headless counterpart of Tomograph.image_reconstruction, without history or plotting. `progress`, if given, is
+    # called with the completed fraction of the run after each stage (each iteration for iterative methods).
+    progress = progress or (lambda fraction: None)
+    image = np.asarray(image, dtype=params.dtype)
+    size = image.shape[0]
+    cached = resultcache.CachedRun(image, params)
+    result = cached.get_result()
+    if result is not None:
+        return result
+    sinogram = cached.get("sinogram")
+    if params.buffer_dir and params.method not in iterative.methods and params.filter_type not in fourier.methods:
+        sinogram, _, image_reconstructed = outofcore.reconstruct_out_of_core(image, params, params.buffer_dir,
+                                                                             params.memory_budget)
+        return sinogram, image_reconstructed
+    if params.method in iterative.methods:
+        system_matrix = params.get_system_matrix(size, "radon", whole=True)
+        if sinogram is None:
+            sinogram = cached.put("sinogram", system_matrix.project(image, params.workers))
+        progress(0.1)
+        return sinogram, cached.put("reconstruction", iterative.reconstruct(
+            sinogram, system_matrix, params.method, params.iterations, params.subsets, original=image,
+            tolerance=params.tolerance, callback=lambda i, *_: progress(0.1 + 0.9 * (i + 1) / params.iterations)))
+    if sinogram is None:
+        sinogram = cached.put("sinogram", radon(image, params.emitter_angles, params.detector_quantity, params.span,
+                                                system_matrix=params.get_system_matrix(size, "radon"),
+                                                workers=params.workers))
+    progress(0.5)
+    if params.filter_type in fourier.methods:
+        return sinogram, cached.put("reconstruction", fourier.reconstruct(
+            sinogram, size, params.emitter_angles, params.detector_quantity, params.span, params.workers))
+    sinogram_filtered = filter_sinogram(sinogram, params.filter_type, cached)
+    progress(0.6)
+    image_reconstructed = inverse_radon(sinogram_filtered, size, params.emitter_angles, params.detector_quantity,
+                                        params.span, system_matrix=params.get_backprojector(size),
+                                        workers=params.workers)
+    return sinogram, cached.put("reconstruction", image_reconstructed)
+
+
+def filter_sinogram(sinogram, filter_type, cached):
+    # Filtered sinograms are cached separately, so a run that only changes the backprojection skips filtering too.
+    if filter_type == "None":
+        return sinogram
+    sinogram_filtered = cached.get("filtered")
+    if sinogram_filtered is None:
+        sinogram_filtered = cached.put("filtered", filter.filter_sinogram(sinogram, filter_type))
+    return sinogram_filtered
+
+
+def get_progressive_stages(size, min_size=32):
+    # (image scale, angle step) per stage, coarse to fine; downscaled stages that would be smaller than min_size
+    # pixels are dropped.
+    return [(scale, step) for scale, step in progressive_stages if scale == 1 or size * scale >= min_size]
+
+
+def reconstruct_preview(image, params, scale, step):
+    # Reconstructs a scale-downsampled image from every step-th angle and proportionally fewer detectors, returning
+    # the coarse sinogram and the reconstruction resized back to the image shape.
+    size = max(1, int(round(image.shape[0] * scale)))
+    detector_quantity = max(1, int(round(params.detector_quantity * scale)))
+    emitter_angles = np.asarray(params.emitter_angles)[::step]
+    image_scaled = resize(image, (size, size), anti_aliasing=True).astype(params.dtype)
+    forward_matrix = projection.get_system_matrix(size, emitter_angles, detector_quantity, params.span, "radon",
+                                                  cache_dir=params.cache_dir, keep_in_memory=False,
+                                                  projector=params.projector, dtype=params.dtype)
+    sinogram = forward_matrix.project(image_scaled, params.workers)
+    if params.filter_type in fourier.methods:
+        image_reconstructed = fourier.reconstruct(sinogram, size, emitter_angles, detector_quantity, params.span,
+                                                  params.workers)
+    else:
+        sinogram_filtered = sinogram
+        if params.filter_type != "None":
+            sinogram_filtered = filter.filter_sinogram(sinogram, params.filter_type)
+        backward_matrix = projection.get_backprojector(size, emitter_angles, detector_quantity, params.span,
+                                                       params.backprojection, cache_dir=params.cache_dir,
+                                                       keep_in_memory=False, projector=params.projector,
+                                                       dtype=params.dtype)
+        image_reconstructed = backward_matrix.backproject(sinogram_filtered, params.workers)
+    return sinogram, resize(image_reconstructed, image.shape, order=1).astype(params.dtype)
+
 
 def generate_angles(theta):
     full_angle = np.pi * 2
@@ -127,48 +389,69 @@ def get_mean_squared_error(original, reconstructed):
     return dif.sum() / dif.size
 
 
-def radon(image, emitter_angles, detector_quantity, span, is_interactive=False, history_builder=None):
-    sinogram = np.zeros((len(emitter_angles), detector_quantity))
-    h, w = image.shape
-    detector_step = span / detector_quantity
-    center = Point(w // 2, h // 2)
-    base = Point(w // 2, 1)
-    halfspan = span / 2.0
-    for i, emitter_angle in enumerate(emitter_angles):
-        source = base.get_coords(center, emitter_angle)
-        detectors_angles = [emitter_angle + np.pi - halfspan + k * detector_step for k in range(detector_quantity)]
-        detectors_positions = [base.get_coords(center, angle) for angle in detectors_angles]
-        rays = []
-        for detector in detectors_positions:
-            path = bresenham.bresenham_indexes(source, detector)
-            path_x_coords = path[:, 0]
-            path_y_coords = path[:, 1]
-            rays.append(image[path_x_coords, path_y_coords].sum())
-        sinogram[i] = rays
-        if is_interactive:
-            history_builder(sinogram=sinogram, iteration=i)
-    # sinogram = sinogram / np.amax(sinogram)
+def iter_radon(image, emitter_angles, detector_quantity, span, system_matrix=None, out=None,
+               projector="bresenham"):
+    # Yields (angle index, projection row). Rows are views into one sinogram buffer, so nothing is copied;
+    # consumers that keep a row past the next step of a reused buffer must copy it themselves.
+    if system_matrix is None:
+        system_matrix = projection.get_system_matrix(image.shape[0], emitter_angles, detector_quantity, span, "radon",
+                                                     projector=projector)
+    sinogram = np.zeros((len(emitter_angles), detector_quantity), dtype=system_matrix.dtype) if out is None else out
+    for i in range(len(emitter_angles)):
+        sinogram[i] = system_matrix.project_angle(image, i)
+        yield i, sinogram[i]
+
+
+def iter_backproject(sinogram, size, emitter_angles, detector_quantity, span, system_matrix=None,
+                     projector="bresenham", backprojection="ray"):
+    # Yields (angle index, pixels, values): the flat pixel indexes touched by one projection and the values added to
+    # them, in ray order. A pixel crossed by several rays appears once per ray.
+    if system_matrix is None:
+        system_matrix = projection.get_backprojector(size, emitter_angles, detector_quantity, span, backprojection,
+                                                     projector=projector)
+    for j, sinogram_projection in enumerate(sinogram):
+        pixels, values = system_matrix.angle_contributions(sinogram_projection, j)
+        yield j, pixels, values
+
+
+def apply_increment(image, pixels, values):
+    np.add.at(image.reshape(-1), pixels, values)
+    return image
+
+
+def radon(image, emitter_angles, detector_quantity, span, is_interactive=False, history_builder=None,
+          system_matrix=None, workers=1, projector="bresenham"):
+    if system_matrix is None:
+        system_matrix = projection.get_system_matrix(image.shape[0], emitter_angles, detector_quantity, span, "radon",
+                                                     projector=projector)
+    profiler.count("projected_angles", len(emitter_angles))
+    with profiler.stage("radon"):
+        if not is_interactive:
+            sinogram = system_matrix.project(image, workers)
+        else:
+            sinogram = np.zeros((len(emitter_angles), detector_quantity), dtype=system_matrix.dtype)
+            for i, _ in iter_radon(image, emitter_angles, detector_quantity, span, system_matrix, out=sinogram):
+                history_builder(sinogram=sinogram, iteration=i)
+    profiler.count("pixels_touched", system_matrix.pixels_touched())  # known after the pass for chunked operators
     return sinogram
 
 
-def inverse_radon(sinogram, size, emitter_angles, detector_quantity, span, is_interactive=False, history_builder=None):
-    height = width = size
-    image = np.zeros((height, width))
-    detector_step = span / detector_quantity
-    w, h = height - 5, width - 5
-    center = Point(int(w / 2), int(h / 2))
-    base = Point(int(w / 2), 0)
-    halfspan = span / 2.0
-    for j, (sinogram_projection, emitter_angle) in enumerate(zip(sinogram, emitter_angles)):
-        source = base.get_coords(center, emitter_angle)
-        detectors_angles = [emitter_angle + np.pi - halfspan + k * detector_step for k in range(detector_quantity)]
-        detectors_positions = [base.get_coords(center, angle) for angle in detectors_angles]
-        for i, detector in enumerate(detectors_positions):
-            path = bresenham.bresenham_indexes(source, detector)
-            image[path[:, 0], path[:, 1]] += sinogram_projection[i]
-        if is_interactive:
-            history_builder(image_reconstructed=image, iteration=j)
-    return np.array(image)
-
-
-params = TomographParameters("examples/sl100.jpg", 1, 100, 180, "ramp")
+def inverse_radon(sinogram, size, emitter_angles, detector_quantity, span, is_interactive=False, history_builder=None,
+                  system_matrix=None, workers=1, projector="bresenham", backprojection="ray"):
+    if system_matrix is None:
+        system_matrix = projection.get_backprojector(size, emitter_angles, detector_quantity, span, backprojection,
+                                                     projector=projector)
+    profiler.count("backprojected_angles", len(emitter_angles))
+    with profiler.stage("backprojection"):
+        if not is_interactive:
+            image = system_matrix.backproject(sinogram, workers)
+        else:
+            image = np.zeros((size, size), dtype=system_matrix.dtype)
+            for j, pixels, values in iter_backproject(sinogram, size, emitter_angles, detector_quantity, span,
+                                                      system_matrix):
+                apply_increment(image, pixels, values)
+                history_builder(image_reconstructed=image, iteration=j)
+            image = np.array(image)
+    profiler.count("pixels_touched", system_matrix.pixels_touched())
+    return image
+
@@ -0,0 +1,58 @@
+import os
+import time
+import numpy as np
+import filter
+import fourier
+import ingest
+
+
+def load_stack(source, resolution=None, mode="pad"):
+    # A directory of slice images or arrays (sorted by name) or a list of paths, ingested like single images and
+    # stacked.
+    if isinstance(source, str):
+        extensions = ingest.image_extensions + ingest.array_extensions
+        source = sorted(os.path.join(source, name) for name in os.listdir(source) if name.lower().endswith(extensions))
+    return np.stack([ingest.load_image(path, resolution, mode) for path in source])
+
+
+class StackReconstruction:
+    def __init__(self, sinograms, image_reconstructed, timings):
+        self.sinograms = sinograms
+        self.image_reconstructed = image_reconstructed
+        self.timings = timings
+
+    def slices_per_second(self):
+        return len(self.image_reconstructed) / self.timings["total"]
+
+
+def reconstruct_stack(volume, params):
+    # Filtered backprojection of every slice of a (slices, size, size) volume. The system matrices are built once
+    # and each ray is gathered/scattered for all slices together.
+    if isinstance(volume, (str, list)):
+        volume = load_stack(volume)
+    size = volume.shape[-1]
+    timings = {}
+    start = time.perf_counter()
+    forward_matrix = params.get_system_matrix(size, "radon")
+    backward_matrix = params.get_backprojector(size)
+    timings["system_matrix"] = time.perf_counter() - start
+    step = time.perf_counter()
+    sinograms = forward_matrix.project(volume, params.workers)
+    timings["radon"] = time.perf_counter() - step
+    step = time.perf_counter()
+    if params.filter_type in fourier.methods:
+        image_reconstructed = np.stack([fourier.reconstruct(sinogram, size, params.emitter_angles,
+                                                            params.detector_quantity, params.span, params.workers)
+                                        for sinogram in sinograms])
+        timings["fourier"] = time.perf_counter() - step
+        timings["total"] = time.perf_counter() - start
+        return StackReconstruction(sinograms, image_reconstructed, timings)
+    sinograms_filtered = sinograms
+    if params.filter_type != "None":
+        sinograms_filtered = filter.filter_sinogram(sinograms, params.filter_type)
+    timings["filtering"] = time.perf_counter() - step
+    step = time.perf_counter()
+    image_reconstructed = backward_matrix.backproject(sinograms_filtered, params.workers)
+    timings["backprojection"] = time.perf_counter() - step
+    timings["total"] = time.perf_counter() - start
+    return StackReconstruction(sinograms, image_reconstructed, timings)